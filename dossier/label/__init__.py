@@ -57,11 +57,25 @@ configuration setup.
 .. autoclass:: LabelStore
 .. autoclass:: Label
 .. autoclass:: CorefValue
+.. autoclass:: Clique
 
+.. automodule:: dossier.label.batch
+.. automodule:: dossier.label.cache
+.. automodule:: dossier.label.components
+.. automodule:: dossier.label.csr
+.. automodule:: dossier.label.graph
 .. automodule:: dossier.label.run
 '''
 from __future__ import absolute_import, division, print_function
 
-from dossier.label.label import Label, LabelStore, CorefValue, expand_labels
-
-__all__ = ['Label', 'LabelStore', 'CorefValue', 'expand_labels']
+from dossier.label.batch import LabelBatch
+from dossier.label.cache import LabelCache
+from dossier.label.components import all_components
+from dossier.label.csr import CsrLabelGraph, write_csr
+from dossier.label.graph import LabelGraph
+from dossier.label.label import Label, LabelStore, CorefValue, Clique, \
+    expand_labels
+
+__all__ = ['Label', 'LabelStore', 'CorefValue', 'Clique', 'expand_labels',
+           'LabelBatch', 'LabelCache', 'LabelGraph', 'CsrLabelGraph',
+           'write_csr', 'all_components']
@@ -0,0 +1,180 @@
+'''dossier.label.batch
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2012-2015 Diffeo, Inc.
+
+Columnar batches of labels for bulk analysis.
+
+:meth:`~dossier.label.LabelStore.everything_batches` returns the
+labels in a store as a sequence of :class:`LabelBatch` objects,
+which hold each field in its own array rather than creating a
+:class:`~dossier.label.Label` per row:
+
+.. code-block:: python
+
+    for batch in label_store.everything_batches():
+        positive = batch.filter(value=CorefValue.Positive, since=t)
+        counts.update(positive.annotator_id)
+
+.. autoclass:: LabelBatch
+
+'''
+from __future__ import absolute_import, division, print_function
+
+from array import array
+from itertools import compress, izip
+
+from dossier.label.label import CorefValue, Label, _COREF_VALUES, _intern
+
+
+class LabelBatch(object):
+    '''A batch of labels stored as parallel columns.
+
+    Row `i` of the batch is the label made from the `i` th entry of
+    every column.  The identifier columns are lists of interned
+    strings, so repeated identifiers share storage; the numeric
+    columns are :mod:`array` arrays.  Every label is in natural
+    order, as :class:`~dossier.label.Label` would normalize it.
+
+    .. attribute:: content_id1
+    .. attribute:: content_id2
+    .. attribute:: subtopic_id1
+    .. attribute:: subtopic_id2
+    .. attribute:: annotator_id
+
+       Lists of :class:`str`.
+
+    .. attribute:: epoch_ticks
+
+       ``array('l')`` of times (64 bits on most platforms).
+
+    .. attribute:: value
+
+       ``array('b')`` of :class:`~dossier.label.CorefValue` values,
+       as integers.
+
+    .. attribute:: rating
+
+       ``array('b')`` of ratings.
+
+    .. automethod:: __init__
+    .. automethod:: __len__
+    .. automethod:: __getitem__
+    .. automethod:: __iter__
+    .. automethod:: append
+    .. automethod:: mask
+    .. automethod:: select
+    .. automethod:: filter
+
+    '''
+    _str_columns = ('content_id1', 'content_id2', 'subtopic_id1',
+                    'subtopic_id2', 'annotator_id')
+    _int_columns = (('epoch_ticks', 'l'), ('value', 'b'), ('rating', 'b'))
+
+    def __init__(self, labels=()):
+        '''Create a batch, optionally from some labels.
+
+        :param labels: iterable of :class:`~dossier.label.Label`
+
+        '''
+        for name in self._str_columns:
+            setattr(self, name, [])
+        for name, typecode in self._int_columns:
+            setattr(self, name, array(typecode))
+        for label in labels:
+            self.append(label)
+
+    def __len__(self):
+        '''Get the number of labels in the batch.'''
+        return len(self.epoch_ticks)
+
+    def __getitem__(self, i):
+        '''Make the :class:`~dossier.label.Label` for row `i`.'''
+        return Label._from_trusted(
+            self.content_id1[i], self.content_id2[i], self.annotator_id[i],
+            _COREF_VALUES[self.value[i]], self.subtopic_id1[i],
+            self.subtopic_id2[i], self.epoch_ticks[i], self.rating[i])
+
+    def __iter__(self):
+        '''Make a :class:`~dossier.label.Label` for every row.'''
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def append(self, label):
+        '''Add a :class:`~dossier.label.Label` to the end of the batch.'''
+        self._append(label.content_id1, label.content_id2,
+                     label.subtopic_id1, label.subtopic_id2,
+                     label.annotator_id, label.epoch_ticks,
+                     label.value.value, label.rating)
+
+    def _append(self, content_id1, content_id2, subtopic_id1, subtopic_id2,
+                annotator_id, epoch_ticks, value, rating):
+        '''Add a row from its field values; `value` is an integer.'''
+        self.content_id1.append(_intern(content_id1))
+        self.content_id2.append(_intern(content_id2))
+        self.subtopic_id1.append(_intern(subtopic_id1))
+        self.subtopic_id2.append(_intern(subtopic_id2))
+        self.annotator_id.append(_intern(annotator_id))
+        self.epoch_ticks.append(epoch_ticks)
+        self.value.append(value)
+        self.rating.append(rating)
+
+    def mask(self, value=None, annotator_id=None, since=None, before=None):
+        '''Find the rows that match some conditions.
+
+        Each condition that is not :const:`None` must hold: the label
+        has :class:`~dossier.label.CorefValue` `value`, was made by
+        `annotator_id`, and has epoch ticks at least `since` and less
+        than `before`.  The result is a list with a boolean per row.
+
+        :param value: coreference value
+        :type value: :class:`~dossier.label.CorefValue` or int
+        :param str annotator_id: annotator id
+        :param since: earliest epoch ticks
+        :param before: epoch ticks to stop before
+        :rtype: list of bool
+
+        '''
+        result = [True] * len(self)
+        if value is not None:
+            if isinstance(value, CorefValue):
+                value = value.value
+            result = [r and v == value for r, v in izip(result, self.value)]
+        if annotator_id is not None:
+            result = [r and a == annotator_id
+                      for r, a in izip(result, self.annotator_id)]
+        if since is not None:
+            result = [r and t >= since
+                      for r, t in izip(result, self.epoch_ticks)]
+        if before is not None:
+            result = [r and t < before
+                      for r, t in izip(result, self.epoch_ticks)]
+        return result
+
+    def select(self, mask):
+        '''Make a new batch of the rows where `mask` is true.
+
+        :param mask: sequence with one boolean per row, as from
+          :meth:`mask`
+        :rtype: :class:`LabelBatch`
+
+        '''
+        batch = LabelBatch()
+        for name in self._str_columns:
+            setattr(batch, name, list(compress(getattr(self, name), mask)))
+        for name, typecode in self._int_columns:
+            setattr(batch, name,
+                    array(typecode, compress(getattr(self, name), mask)))
+        return batch
+
+    def filter(self, value=None, annotator_id=None, since=None, before=None):
+        '''Make a new batch of the rows that match some conditions.
+
+        This is ``self.select(self.mask(...))``; see :meth:`mask` for
+        the conditions.
+
+        :rtype: :class:`LabelBatch`
+
+        '''
+        return self.select(self.mask(value=value, annotator_id=annotator_id,
+                                     since=since, before=before))
@@ -0,0 +1,178 @@
+'''dossier.label.cache
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2012-2015 Diffeo, Inc.
+
+A bounded read-through cache for :class:`~dossier.label.LabelStore`.
+
+Pass a :class:`LabelCache` to the label store to keep the results of
+recent :meth:`~dossier.label.LabelStore.get` and
+:meth:`~dossier.label.LabelStore.directly_connected` calls in
+memory:
+
+.. code-block:: python
+
+    cache = LabelCache(max_entries=10000)
+    label_store = LabelStore(kvlayer.client(), cache=cache)
+
+Every cached entry is tagged with the content IDs it depends on.
+When the store writes a label, it invalidates every entry for both
+of the label's content IDs.  The cache only sees writes made through
+its own :class:`~dossier.label.LabelStore`, so it should not be used
+when other processes write labels that must be read back promptly.
+
+.. autoclass:: LabelCache
+
+'''
+from __future__ import absolute_import, division, print_function
+
+from collections import OrderedDict
+import sys
+
+
+class LabelCache(object):
+    '''A least-recently-used cache of lists of labels.
+
+    The cache may be bounded by number of entries, by approximate
+    size in bytes, or both.  When either bound is exceeded, the
+    least recently used entries are evicted until it is not.
+
+    .. attribute:: hits
+
+       Number of lookups that found an entry.
+
+    .. attribute:: misses
+
+       Number of lookups that did not find an entry.
+
+    .. attribute:: evictions
+
+       Number of entries removed to stay within the bounds.
+
+    .. automethod:: __init__
+    .. automethod:: get
+    .. automethod:: put
+    .. automethod:: invalidate
+    .. automethod:: clear
+    .. automethod:: stats
+
+    '''
+    def __init__(self, max_entries=None, max_bytes=None):
+        '''Create a new cache.
+
+        :param int max_entries: maximum number of cached entries,
+          or :const:`None` for no limit
+        :param int max_bytes: maximum approximate size of the cached
+          labels, or :const:`None` for no limit
+
+        '''
+        if max_entries is None and max_bytes is None:
+            raise ValueError('a LabelCache needs max_entries or max_bytes')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.num_bytes = 0
+        # key -> (labels, content_ids, size)
+        self._entries = OrderedDict()
+        # content_id -> set of keys
+        self._by_content_id = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        '''Look up a list of labels.
+
+        Returns :const:`None` if `key` is not cached.  Finding `key`
+        marks it as most recently used.
+
+        '''
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries[key] = entry
+        return entry[0]
+
+    def put(self, key, labels, content_ids):
+        '''Add a list of labels to the cache.
+
+        `content_ids` are the content IDs whose labels went into
+        `labels`; a later :meth:`invalidate` of any of them removes
+        this entry.
+
+        '''
+        self._discard(key)
+        size = _approximate_size(labels)
+        self._entries[key] = (labels, content_ids, size)
+        self.num_bytes += size
+        for content_id in content_ids:
+            self._by_content_id.setdefault(content_id, set()).add(key)
+        while self._entries and self._over_limit():
+            self._discard(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, content_ids):
+        '''Remove every entry that depends on any of `content_ids`.'''
+        for content_id in content_ids:
+            for key in self._by_content_id.pop(content_id, ()):
+                self._discard(key)
+
+    def clear(self):
+        '''Remove every entry from the cache.
+
+        This does not reset the counters.
+
+        '''
+        self._entries.clear()
+        self._by_content_id.clear()
+        self.num_bytes = 0
+
+    def stats(self):
+        '''Get a dictionary of the cache counters and current size.'''
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.num_bytes,
+        }
+
+    def _over_limit(self):
+        if self.max_entries is not None and \
+           len(self._entries) > self.max_entries:
+            return True
+        if self.max_bytes is not None and self.num_bytes > self.max_bytes:
+            return True
+        return False
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        _, content_ids, size = entry
+        self.num_bytes -= size
+        for content_id in content_ids:
+            keys = self._by_content_id.get(content_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_content_id[content_id]
+
+
+def _approximate_size(labels):
+    '''Estimate the memory used by a list of labels.
+
+    Identifier strings are usually shared with other labels, so
+    only the label objects and the list are counted.  A
+    :class:`~dossier.label.Label` keeps its fields in slots, so its
+    own size includes them.
+
+    '''
+    size = sys.getsizeof(labels)
+    for label in labels:
+        size += sys.getsizeof(label)
+    return size
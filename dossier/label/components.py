@@ -0,0 +1,119 @@
+'''dossier.label.components
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2012-2015 Diffeo, Inc.
+
+Connected components of every label at once.
+
+:func:`all_components` reads every current label once and finds the
+positive component of every ident in the store, which is much faster
+than calling :meth:`~dossier.label.LabelStore.connected_component`
+for each one:
+
+.. code-block:: python
+
+    clusters = all_components(label_store)
+    clusters[('a', None)]
+
+This needs :mod:`numpy`, which is not installed with
+:mod:`dossier.label`; install the ``numpy`` extra to get it.
+
+.. autofunction:: all_components
+
+'''
+from __future__ import absolute_import, division, print_function
+
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from dossier.label.label import CorefValue, idents_from_label
+
+
+def all_components(label_store, subtopic=False):
+    '''Find the positive connected component of every ident.
+
+    Every ident of every current label in `label_store` is a node,
+    and every :attr:`~dossier.label.CorefValue.Positive` label is an
+    edge between its two idents, as given by
+    :func:`~dossier.label.label.idents_from_label`.  Each component
+    is named by its smallest ident.  An ident whose only labels are
+    negative or unknown is a component of its own.
+
+    The labels are read in one pass of `label_store.everything()`,
+    so `label_store` may also be a :class:`~dossier.label.LabelGraph`.
+    Only the idents and two integer arrays of edges are held in
+    memory, and the components are found with vectorized operations
+    on those arrays.
+
+    :param label_store: labels to read
+    :type label_store: :class:`~dossier.label.LabelStore`
+    :param bool subtopic: if true, idents are
+      ``(content_id, subtopic_id)``; otherwise
+      ``(content_id, None)``
+    :return: map from each ident to the smallest ident in its
+      component
+    :rtype: dict
+    :raises: :exc:`ImportError` if :mod:`numpy` is not installed
+
+    '''
+    if np is None:
+        raise ImportError('all_components() requires numpy')
+    index = {}
+    sources = array('l')
+    targets = array('l')
+    for label in label_store.everything():
+        ident1, ident2 = idents_from_label(label, subtopic=subtopic)
+        i = index.setdefault(ident1, len(index))
+        j = index.setdefault(ident2, len(index))
+        if label.value == CorefValue.Positive and i != j:
+            sources.append(i)
+            targets.append(j)
+
+    # Renumber the idents in sorted order, so that the smallest
+    # number in a component is its smallest ident.
+    idents = sorted(index)
+    rank = np.empty(len(idents), dtype=np.int64)
+    rank[[index[ident] for ident in idents]] = np.arange(len(idents))
+    sources = rank[np.frombuffer(sources, dtype='l')]
+    targets = rank[np.frombuffer(targets, dtype='l')]
+
+    roots = _min_label_components(len(idents), sources, targets)
+    return dict((ident, idents[root]) for ident, root in zip(idents, roots))
+
+
+def _min_label_components(n, sources, targets):
+    '''Label every node with the smallest node in its component.
+
+    This alternates hooking, where the root of each edge's larger
+    end is pointed at the smaller root, with pointer jumping until
+    every node points at a root, and stops when both ends of every
+    edge have the same root.  A node only ever points at a smaller
+    one, so there are no cycles.
+
+    :param int n: number of nodes
+    :param sources: :mod:`numpy` array of one end of each edge
+    :param targets: :mod:`numpy` array of the other end of each edge
+    :return: :mod:`numpy` array of the root of each node
+
+    '''
+    parent = np.arange(n)
+    while True:
+        source_roots = parent[sources]
+        target_roots = parent[targets]
+        unfinished = source_roots != target_roots
+        if not unfinished.any():
+            return parent
+        source_roots = source_roots[unfinished]
+        target_roots = target_roots[unfinished]
+        low = np.minimum(source_roots, target_roots)
+        np.minimum.at(parent, source_roots, low)
+        np.minimum.at(parent, target_roots, low)
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
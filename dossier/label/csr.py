@@ -0,0 +1,312 @@
+'''dossier.label.csr
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2012-2015 Diffeo, Inc.
+
+A read-only label graph file that many processes can share.
+
+:func:`write_csr` writes the labels of one
+:class:`~dossier.label.CorefValue` as a graph of content IDs in
+compressed sparse row form, and :class:`CsrLabelGraph` answers
+queries from such a file through :mod:`mmap`, without reading it
+into memory.  Every process that opens the same file shares one
+copy of it in the operating system's page cache:
+
+.. code-block:: python
+
+    write_csr(label_store.everything(), 'positive.csr')
+
+    graph = CsrLabelGraph('positive.csr')
+    graph.component('a')
+
+The file holds, in order and all little-endian:
+
+* a header: the magic string ``DLCSR001``, then the number of
+  content IDs, the number of edges and the number of bytes of
+  content IDs as unsigned 64-bit integers, then the value of the
+  labels as a signed 64-bit integer;
+* the offset of each content ID in the ID bytes, plus the end, as
+  unsigned 64-bit integers;
+* the offset of each content ID's first edge, plus the end, as
+  unsigned 64-bit integers;
+* the epoch ticks of each edge as signed 64-bit integers;
+* the index of the other content ID of each edge as unsigned
+  32-bit integers;
+* the rating of each edge as signed 8-bit integers;
+* the content IDs, sorted, concatenated.
+
+Each label is an edge in both directions, except that a label
+between two subtopics of the same content ID is a single edge.
+The edges of each content ID are sorted by the other content ID.
+
+.. autofunction:: write_csr
+.. autoclass:: CsrLabelGraph
+
+'''
+from __future__ import absolute_import, division, print_function
+
+from bisect import bisect_left
+import mmap
+import struct
+
+from dossier.label.label import CorefValue
+
+MAGIC = 'DLCSR001'
+_HEADER = struct.Struct('<8sQQQq')
+_CHUNK = 65536
+
+
+def write_csr(labels, path, value=CorefValue.Positive):
+    '''Write a label graph file.
+
+    Only `labels` with `value` are included.  `labels` should not
+    include superseded labels; the result of
+    :meth:`~dossier.label.LabelStore.everything` is suitable.
+    The edges are held in memory while the file is written.
+
+    :param labels: iterable of :class:`~dossier.label.Label`
+    :param str path: file to write
+    :param value: value of the labels to include
+    :type value: :class:`~dossier.label.CorefValue`
+    :return: number of content IDs and number of edges
+    :rtype: ``(int, int)``
+
+    '''
+    edges = []
+    for label in labels:
+        if label.value != value:
+            continue
+        edges.append((label.content_id1, label.content_id2,
+                      label.epoch_ticks, label.rating))
+        if label.content_id1 != label.content_id2:
+            edges.append((label.content_id2, label.content_id1,
+                          label.epoch_ticks, label.rating))
+    edges.sort()
+    content_ids = sorted(set(e[0] for e in edges))
+    index = dict((content_id, i) for i, content_id in enumerate(content_ids))
+
+    id_offsets = [0]
+    for content_id in content_ids:
+        id_offsets.append(id_offsets[-1] + len(content_id))
+    edge_offsets = [0] * (len(content_ids) + 1)
+    for e in edges:
+        edge_offsets[index[e[0]] + 1] += 1
+    for i in xrange(len(content_ids)):
+        edge_offsets[i + 1] += edge_offsets[i]
+
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(content_ids), len(edges),
+                             id_offsets[-1], value.value))
+        _write_array(f, 'Q', id_offsets)
+        _write_array(f, 'Q', edge_offsets)
+        _write_array(f, 'q', [e[2] for e in edges])
+        _write_array(f, 'I', [index[e[1]] for e in edges])
+        _write_array(f, 'b', [e[3] for e in edges])
+        for content_id in content_ids:
+            f.write(content_id)
+    return len(content_ids), len(edges)
+
+
+def _write_array(f, fmt, values):
+    for start in xrange(0, len(values), _CHUNK):
+        chunk = values[start:start + _CHUNK]
+        f.write(struct.pack('<%d%s' % (len(chunk), fmt), *chunk))
+
+
+class CsrLabelGraph(object):
+    '''A label graph file, opened read-only through :mod:`mmap`.
+
+    Content IDs are found by binary search of the file, and edges
+    are read from it as they are needed, so opening a graph takes
+    constant time and memory.
+
+    .. attribute:: value
+
+       The :class:`~dossier.label.CorefValue` of every edge.
+
+    .. automethod:: __init__
+    .. automethod:: __len__
+    .. automethod:: __contains__
+    .. automethod:: __iter__
+    .. automethod:: close
+    .. automethod:: edges
+    .. automethod:: neighbors
+    .. automethod:: pair
+    .. automethod:: component
+    .. automethod:: connected
+
+    '''
+    def __init__(self, path):
+        '''Open a file written by :func:`write_csr`.
+
+        :param str path: file to open
+
+        '''
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self._num_ids, self._num_edges, id_bytes,
+         value) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('{0!r} is not a label graph file'.format(path))
+        self.value = CorefValue(value)
+        self._id_offsets = _HEADER.size
+        self._edge_offsets = self._id_offsets + 8 * (self._num_ids + 1)
+        self._ticks = self._edge_offsets + 8 * (self._num_ids + 1)
+        self._targets = self._ticks + 8 * self._num_edges
+        self._ratings = self._targets + 4 * self._num_edges
+        self._ids = self._ratings + self._num_edges
+
+    def __len__(self):
+        '''Get the number of content IDs in the graph.'''
+        return self._num_ids
+
+    def __contains__(self, content_id):
+        '''Check whether `content_id` has any edges.'''
+        return self._index(content_id) is not None
+
+    def __iter__(self):
+        '''Iterate over the content IDs in sorted order.'''
+        for i in xrange(self._num_ids):
+            yield self._content_id(i)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''Unmap the file.'''
+        self._mm.close()
+
+    def edges(self, content_id):
+        '''Get the edges of a content ID.
+
+        :param str content_id: content id
+        :return: list of ``(other_content_id, rating, epoch_ticks)``
+          sorted by the other content ID
+
+        '''
+        i = self._index(content_id)
+        if i is None:
+            return []
+        start, end = self._row(i)
+        return [(self._content_id(target), rating, ticks)
+                for target, rating, ticks in self._read_edges(start, end)]
+
+    def neighbors(self, content_id):
+        '''Get the content IDs with an edge to a content ID.
+
+        :param str content_id: content id
+        :return: sorted list of distinct content IDs
+
+        '''
+        i = self._index(content_id)
+        if i is None:
+            return []
+        return [self._content_id(j) for j in self._neighbor_indexes(i)]
+
+    def pair(self, content_id1, content_id2):
+        '''Get the edges between two content IDs.
+
+        :param str content_id1: content id
+        :param str content_id2: content id
+        :return: list of ``(rating, epoch_ticks)``
+
+        '''
+        i = self._index(content_id1)
+        j = self._index(content_id2)
+        if i is None or j is None:
+            return []
+        start, end = self._row(i)
+        targets = self._read_targets(start, end)
+        first = bisect_left(targets, j)
+        last = first
+        while last < len(targets) and targets[last] == j:
+            last += 1
+        return [(rating, ticks) for _, rating, ticks
+                in self._read_edges(start + first, start + last)]
+
+    def component(self, content_id):
+        '''Get the connected component of a content ID.
+
+        For a graph of positive labels, this is the same set of
+        content IDs as the labels from
+        :meth:`~dossier.label.LabelStore.connected_component` touch.
+        `content_id` itself is always included.
+
+        :param str content_id: content id
+        :return: sorted list of content IDs
+
+        '''
+        i = self._index(content_id)
+        if i is None:
+            return [content_id]
+        return [self._content_id(j) for j in sorted(self._component(i))]
+
+    def connected(self, content_id1, content_id2):
+        '''Check whether two content IDs are in the same component.
+
+        :param str content_id1: content id
+        :param str content_id2: content id
+        :rtype: bool
+
+        '''
+        if content_id1 == content_id2:
+            return True
+        i = self._index(content_id1)
+        j = self._index(content_id2)
+        if i is None or j is None:
+            return False
+        return j in self._component(i)
+
+    def _component(self, i):
+        seen = set([i])
+        todo = [i]
+        while todo:
+            for j in self._neighbor_indexes(todo.pop()):
+                if j not in seen:
+                    seen.add(j)
+                    todo.append(j)
+        return seen
+
+    def _index(self, content_id):
+        '''Find the index of a content ID by binary search.'''
+        lo, hi = 0, self._num_ids
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._content_id(mid) < content_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._num_ids and self._content_id(lo) == content_id:
+            return lo
+        return None
+
+    def _content_id(self, i):
+        start, end = struct.unpack_from('<QQ', self._mm,
+                                        self._id_offsets + 8 * i)
+        return self._mm[self._ids + start:self._ids + end]
+
+    def _row(self, i):
+        return struct.unpack_from('<QQ', self._mm, self._edge_offsets + 8 * i)
+
+    def _read_targets(self, start, end):
+        return struct.unpack_from('<%dI' % (end - start), self._mm,
+                                  self._targets + 4 * start)
+
+    def _read_edges(self, start, end):
+        n = end - start
+        targets = self._read_targets(start, end)
+        ratings = struct.unpack_from('<%db' % n, self._mm,
+                                     self._ratings + start)
+        ticks = struct.unpack_from('<%dq' % n, self._mm,
+                                   self._ticks + 8 * start)
+        return zip(targets, ratings, ticks)
+
+    def _neighbor_indexes(self, i):
+        start, end = self._row(i)
+        targets = self._read_targets(start, end)
+        return [j for k, j in enumerate(targets)
+                if k == 0 or targets[k - 1] != j]
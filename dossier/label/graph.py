@@ -0,0 +1,238 @@
+'''dossier.label.graph
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2012-2015 Diffeo, Inc.
+
+An in-memory snapshot of a label store.
+
+A :class:`LabelGraph` reads every current label from a
+:class:`~dossier.label.LabelStore` once, and then answers the same
+queries from memory:
+
+.. code-block:: python
+
+    graph = LabelGraph(label_store)
+    graph.connected_component('a')
+    graph.expand(('a', 'subtopic'))
+
+It does not see labels written after it is built until
+:meth:`LabelGraph.refresh` is called.
+
+.. autoclass:: LabelGraph
+
+'''
+from __future__ import absolute_import, division, print_function
+
+from dossier.label.label import Label, _LabelQueries, _intern, \
+    normalize_ident
+
+
+class LabelGraph(_LabelQueries):
+    '''An in-memory graph of the current labels in a store.
+
+    The graph holds the most recent :class:`~dossier.label.Label`
+    for every label subject, indexed by content ID and by
+    ``(content_id, subtopic_id)`` ident.  Its query methods take the
+    same parameters and return the same results as those of
+    :class:`~dossier.label.LabelStore`, without reading the store.
+    The content, subtopic and annotator IDs of the labels are
+    interned, so each is stored once.
+
+    .. attribute:: label_store
+
+       The :class:`~dossier.label.LabelStore` the graph was built
+       from.
+
+    .. attribute:: watermark
+
+       The largest :attr:`~dossier.label.Label.epoch_ticks` of any
+       label in the graph, or :const:`None` if it is empty.
+
+    .. automethod:: __init__
+    .. automethod:: __len__
+    .. automethod:: reload
+    .. automethod:: refresh
+    .. automethod:: add
+    .. automethod:: get
+    .. automethod:: directly_connected
+    .. automethod:: connected_component
+    .. automethod:: are_coreferent
+    .. automethod:: expand
+    .. automethod:: clique
+    .. automethod:: iter_expand
+    .. automethod:: expand_count
+    .. automethod:: expanded_pairs
+    .. automethod:: negative_inference
+    .. automethod:: negative_inference_many
+    .. automethod:: negative_label_inference
+    .. automethod:: find_conflicts
+    .. automethod:: everything
+
+    '''
+    intern_ids = True
+
+    def __init__(self, label_store):
+        '''Build a graph from every current label in `label_store`.
+
+        This reads the store in a single pass of
+        :meth:`~dossier.label.LabelStore.everything`.
+
+        :param label_store: store to read
+        :type label_store: :class:`~dossier.label.LabelStore`
+
+        '''
+        self.label_store = label_store
+        self.reload()
+
+    def __len__(self):
+        '''Get the number of labels in the graph.'''
+        return len(self._labels)
+
+    def reload(self):
+        '''Discard the graph and read the store again.'''
+        # subject key -> Label
+        self._labels = {}
+        # content_id -> {subject key -> Label}
+        self._by_content_id = {}
+        # (content_id, subtopic_id) -> {subject key -> Label}
+        self._by_subtopic = {}
+        self.watermark = None
+        self._cursor = None
+        for label in self.label_store.everything():
+            self.add(label)
+
+    def refresh(self, batch_size=1000):
+        '''Add the labels written since the graph was last updated.
+
+        If the store was created with `change_log` enabled, this
+        reads labels from
+        :meth:`~dossier.label.LabelStore.labels_since`, starting
+        from the :attr:`watermark` and then from where the previous
+        refresh stopped.  The change log is ordered by label time,
+        so a label written with an :attr:`~dossier.label.Label.epoch_ticks`
+        older than the watermark is not seen; :meth:`reload` picks
+        it up.  Labels written later with the same time as the last
+        one read are seen.  Without a change log this is the same as
+        :meth:`reload`.
+
+        :param int batch_size: number of labels to read at a time
+        :return: number of labels read
+
+        '''
+        if not self.label_store.change_log:
+            self.reload()
+            return len(self)
+        ticks = self.watermark if self.watermark is not None else 0
+        count = 0
+        while True:
+            labels, cursor = self.label_store.labels_since(
+                ticks, cursor=self._cursor, limit=batch_size)
+            self._cursor = cursor
+            for label in labels:
+                self.add(label)
+            count += len(labels)
+            if len(labels) < batch_size:
+                return count
+
+    def add(self, label):
+        '''Add a label to the graph.
+
+        `label` replaces the label in the graph with the same subject
+        (see :meth:`~dossier.label.Label.same_subject_as`) unless
+        that one is more recent.  The graph keeps a copy of `label`
+        with interned IDs, and does not write to the store.
+
+        '''
+        key = self._key_prefix(label.content_id1, label.content_id2,
+                               label.annotator_id, label.subtopic_id1,
+                               label.subtopic_id2)
+        old = self._labels.get(key)
+        if old is not None and old.epoch_ticks > label.epoch_ticks:
+            return
+        label = Label._from_trusted(
+            _intern(label.content_id1), _intern(label.content_id2),
+            _intern(label.annotator_id), label.value,
+            _intern(label.subtopic_id1), _intern(label.subtopic_id2),
+            label.epoch_ticks, label.rating)
+        self._labels[key] = label
+        for content_id, subtopic_id in ((label.content_id1,
+                                         label.subtopic_id1),
+                                        (label.content_id2,
+                                         label.subtopic_id2)):
+            self._by_content_id.setdefault(content_id, {})[key] = label
+            self._by_subtopic.setdefault((content_id, subtopic_id),
+                                         {})[key] = label
+        if self.watermark is None or label.epoch_ticks > self.watermark:
+            self.watermark = label.epoch_ticks
+
+    def get(self, cid1, cid2, annotator_id, subid1='', subid2=''):
+        '''Get a label from the graph.
+
+        This takes the same parameters as
+        :meth:`~dossier.label.LabelStore.get`.
+
+        :rtype: :class:`~dossier.label.Label`
+        :raises: :exc:`KeyError` if no label could be found.
+
+        '''
+        key = self._key_prefix(cid1, cid2, annotator_id, subid1, subid2)
+        return self._labels[key]
+
+    def directly_connected(self, ident):
+        '''Return a generator of labels connected to ``ident``.
+
+        See :meth:`~dossier.label.LabelStore.directly_connected`.
+
+        :param ident: content id or (content id and subtopic id)
+        :type ident: ``str`` or ``(str, str)``
+        :rtype: generator of :class:`~dossier.label.Label`
+        '''
+        ident = normalize_ident(ident)
+        return iter(self._directly_connected_many([ident])[ident])
+
+    def _directly_connected_many(self, idents):
+        '''Find the labels directly connected to several idents.
+
+        `idents` must be normalized.  The labels for each are in the
+        order the store would return them: by the other content ID,
+        then the subtopic IDs, then annotator ID.
+
+        '''
+        result = {}
+        for ident in idents:
+            content_id, subtopic_id = ident
+            if subtopic_id is None:
+                labels = self._by_content_id.get(content_id, {})
+            else:
+                labels = self._by_subtopic.get(ident, {})
+            result[ident] = sorted(
+                labels.itervalues(),
+                key=lambda label: _order_from(label, content_id))
+        return result
+
+    def everything(self, include_deleted=False, content_id=None,
+                   subtopic_id=None):
+        '''Return a generator of the labels in the graph.
+
+        This takes the same parameters as
+        :meth:`~dossier.label.LabelStore.everything`, except that
+        the graph does not hold superseded labels, so
+        `include_deleted` must be :const:`False`.
+
+        :rtype: generator of :class:`~dossier.label.Label`
+
+        '''
+        if include_deleted:
+            raise ValueError('a LabelGraph has no deleted labels')
+        if content_id is None:
+            return iter(sorted(self._labels.itervalues()))
+        return self.directly_connected((content_id, subtopic_id))
+
+
+def _order_from(label, content_id):
+    '''Get the store's sort key for `label` as seen from `content_id`.'''
+    if label.content_id1 == content_id:
+        return (label.content_id2, label.subtopic_id1, label.subtopic_id2,
+                label.annotator_id)
+    return (label.content_id1, label.subtopic_id2, label.subtopic_id1,
+            label.annotator_id)
@@ -8,9 +8,11 @@ from __future__ import absolute_import, division, print_function
 from collections import Container, Hashable
 from datetime import datetime
 import functools
-from itertools import imap, combinations, ifilter
+from itertools import imap, combinations, groupby, ifilter, islice, starmap
 import logging
 import struct
+import sys
+import threading
 import time
 
 import enum
@@ -75,8 +77,21 @@ class CorefValue(enum.Enum):
         return NotImplemented
 
 
+_COREF_VALUES = dict((v.value, v) for v in CorefValue)
+
+
+def _intern(s):
+    '''Intern `s` if it is a :class:`str`.
+
+    :func:`intern` only accepts byte strings, so a :class:`unicode`
+    ID is returned as it is.
+
+    '''
+    return intern(s) if isinstance(s, str) else s
+
+
 @functools.total_ordering
-class Label(Container, Hashable):
+class Label(object):
     '''An immutable unit of ground truth data.
 
     This is a statement that the item at :attr:`content_id1`,
@@ -94,6 +109,9 @@ class Label(Container, Hashable):
     :attr:`annotator_id`, :attr:`epoch_ticks` (most recent is
     smallest), and then other fields.
 
+    Labels have no per-instance dictionary, since a scan of a large
+    store may create millions of them.
+
     .. automethod:: __init__
     .. automethod:: __contains__
     .. automethod:: other
@@ -102,6 +120,13 @@ class Label(Container, Hashable):
     .. automethod:: most_recent
 
     '''
+    __slots__ = ('content_id1', 'content_id2', 'subtopic_id1',
+                 'subtopic_id2', 'annotator_id', 'value', 'epoch_ticks',
+                 'rating')
+
+    # The fields in the order of the positional parameters to __init__
+    _fields = ('content_id1', 'content_id2', 'annotator_id', 'value',
+               'subtopic_id1', 'subtopic_id2', 'epoch_ticks', 'rating')
 
     def __init__(self, content_id1, content_id2, annotator_id, value,
                  subtopic_id1=None, subtopic_id2=None, epoch_ticks=None,
@@ -116,8 +141,6 @@ class Label(Container, Hashable):
         `value` is :attr:`CorefValue.Positive` and 0 otherwise.
 
         '''
-        super(Label, self).__init__()
-
         # Fix up and provide defaults for various parameters
         if isinstance(value, int):
             value = CorefValue(value)
@@ -152,6 +175,32 @@ class Label(Container, Hashable):
         self.epoch_ticks = epoch_ticks
         self.rating = rating
 
+    @classmethod
+    def _from_trusted(cls, content_id1, content_id2, annotator_id, value,
+                      subtopic_id1, subtopic_id2, epoch_ticks, rating):
+        '''Create a label from fields that are already normalized.
+
+        This skips all of the work :meth:`__init__` does.  `value`
+        must be a :class:`CorefValue`, every other field must be
+        given, and ``(content_id1, subtopic_id1)`` must not be greater
+        than ``(content_id2, subtopic_id2)``.
+
+        '''
+        self = cls.__new__(cls)
+        self.content_id1 = content_id1
+        self.content_id2 = content_id2
+        self.subtopic_id1 = subtopic_id1
+        self.subtopic_id2 = subtopic_id2
+        self.annotator_id = annotator_id
+        self.value = value
+        self.epoch_ticks = epoch_ticks
+        self.rating = rating
+        return self
+
+    def __reduce__(self):
+        return (self.__class__,
+                tuple(getattr(self, field) for field in self._fields))
+
     def __contains__(self, v):
         '''Tests membership of identifiers.
 
@@ -375,16 +424,384 @@ class Label(Container, Hashable):
                 'rating={0.rating})'.format(self))
 
 
-class LabelStore(object):
+Container.register(Label)
+Hashable.register(Label)
+
+
+class _LabelQueries(object):
+    '''Queries that follow labels from ident to ident.
+
+    This is shared by :class:`LabelStore` and
+    :class:`~dossier.label.graph.LabelGraph`.  Subclasses provide
+    :meth:`directly_connected`, ``_directly_connected_many``,
+    ``everything`` and an ``intern_ids`` attribute.
+
+    '''
+    def _key_prefix(self, cid1, cid2, annotator_id, subid1='', subid2=''):
+        '''Make the key prefix of all revisions of a label.
+
+        The prefix is always in the natural order of the label, so
+        that both orders of the same pair share a prefix.
+
+        '''
+        if cid2 < cid1 or (cid2 == cid1 and subid2 < subid1):
+            cid1, cid2, subid1, subid2 = cid2, cid1, subid2, subid1
+        return (cid1, cid2, subid1, subid2, annotator_id)
+
+    def _intern_ident(self, ident):
+        '''Intern the strings in a normalized ident, if enabled.
+
+        Every other ident a search finds comes from a label, so with
+        this all of the idents in the search share their strings.
+
+        '''
+        if not self.intern_ids:
+            return ident
+        content_id, subtopic_id = ident
+        return (_intern(content_id), _intern(subtopic_id))
+
+    def connected_component(self, ident):
+        '''Return a connected component generator for ``ident``.
+
+        ``ident`` may be a ``content_id`` or a ``(content_id,
+        subtopic_id)``.
+
+        Given an ``ident``, return the corresponding connected
+        component by following all positive transitivity relationships.
+
+        For example, if ``(a, b, 1)`` is a label and ``(b, c, 1)`` is
+        a label, then ``connected_component('a')`` will return both
+        labels even though ``a`` and ``c`` are not directly connected.
+
+        (Note that even though this returns a generator, it will still
+        consume memory proportional to the number of labels in the
+        connected component.)
+
+        The search proceeds breadth-first, and every identifier at
+        the same distance from ``ident`` is looked up at once.  Most
+        :mod:`kvlayer` backends send one query per identifier, one
+        after another; if the :class:`LabelStore` has `scan_clients`,
+        those queries are run concurrently, so that with enough
+        clients the time taken grows with the diameter of the
+        component rather than its size.
+
+        :param ident: content id or (content id and subtopic id)
+        :type ident: ``str`` or ``(str, str)``
+        :rtype: generator of :class:`Label`
+        '''
+        ident = self._intern_ident(normalize_ident(ident))
+        subtopic = ident_has_subtopic(ident)
+        done = set()  # set of cids that we've queried with
+        todo = set([ident])  # set of cids to do a query for
+        seen = set()  # labels already yielded
+        while todo:
+            frontier = sorted(todo)
+            done.update(frontier)
+            todo = set()
+            connected = self._directly_connected_many(frontier)
+            for ident in frontier:
+                for label in connected[ident]:
+                    if label.value != CorefValue.Positive:
+                        continue
+                    ident1, ident2 = idents_from_label(
+                        label, subtopic=subtopic)
+                    if ident1 not in done:
+                        todo.add(ident1)
+                    if ident2 not in done:
+                        todo.add(ident2)
+
+                    if label not in seen:
+                        seen.add(label)
+                        yield label
+
+    def are_coreferent(self, ident1, ident2):
+        '''Determine if two idents are transitively coreferent.
+
+        ``ident1`` and ``ident2`` may each be a ``content_id`` or a
+        ``(content_id, subtopic_id)``, but must be the same kind.
+        This returns :const:`True` if and only if ``ident2`` is in the
+        :meth:`connected_component` of ``ident1``.
+
+        Rather than finding the whole component, this searches
+        breadth-first from both idents at once, always extending the
+        smaller frontier, and stops as soon as the two searches meet.
+        Each frontier is looked up at once, concurrently if the
+        :class:`LabelStore` has `scan_clients`.
+
+        :param ident1: content id or (content id and subtopic id)
+        :param ident2: content id or (content id and subtopic id)
+        :rtype: bool
+        '''
+        ident1 = self._intern_ident(normalize_ident(ident1))
+        ident2 = self._intern_ident(normalize_ident(ident2))
+        subtopic = ident_has_subtopic(ident1)
+        if subtopic != ident_has_subtopic(ident2):
+            raise ValueError('cannot compare {0!r} with {1!r}'
+                             .format(ident1, ident2))
+        if ident1 == ident2:
+            return True
+
+        seen = [set([ident1]), set([ident2])]
+        frontiers = [[ident1], [ident2]]
+        while frontiers[0] and frontiers[1]:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            mine, theirs = seen[side], seen[1 - side]
+            todo = set()
+            connected = self._directly_connected_many(frontiers[side])
+            for ident in frontiers[side]:
+                for label in connected[ident]:
+                    if label.value != CorefValue.Positive:
+                        continue
+                    for other in idents_from_label(label, subtopic=subtopic):
+                        if other in theirs:
+                            return True
+                        if other not in mine:
+                            mine.add(other)
+                            todo.add(other)
+            frontiers[side] = sorted(todo)
+        return False
+
+    def expand(self, ident):
+        '''Return expanded set of labels from a connected component.
+
+        The connected component is derived from ``ident``. ``ident``
+        may be a ``content_id`` or a ``(content_id, subtopic_id)``.
+        If ``ident`` identifies a subtopic, then expansion is done
+        on a subtopic connected component (and expanded labels retain
+        subtopic information).
+
+        The labels returned by :meth:`LabelStore.connected_component`
+        contains only the :class:`Label` stored in the
+        :class:`LabelStore`, and does not include the labels you can
+        infer from the connected component. This method returns both
+        the data-backed labels and the inferred labels.
+
+        Subtopic assignments of the expanded labels will be empty. The
+        ``annotator_id`` will be an arbitrary ``annotator_id`` within
+        the connected component.
+
+        :param str content_id: content id
+        :param value: coreferent value
+        :type value: :class:`CorefValue`
+        :rtype: ``list`` of :class:`Label`
+        '''
+        return list(self.iter_expand(ident))
+
+    def clique(self, ident):
+        '''Return the expanded connected component of ``ident``.
+
+        This holds the same information as :meth:`expand` in a
+        :class:`Clique`, without creating a label for every pair.
+        ``ident`` itself is always in the clique.
+
+        :param ident: content id or (content id and subtopic id)
+        :type ident: ``str`` or ``(str, str)``
+        :rtype: :class:`Clique`
+        '''
+        ident = normalize_ident(ident)
+        return Clique(self.connected_component(ident),
+                      subtopic=ident_has_subtopic(ident), idents=[ident])
+
+    def iter_expand(self, ident):
+        '''Return a generator of the labels :meth:`expand` returns.
+
+        The data-backed labels of the connected component are held
+        in memory, but the inferred labels are created one at a time
+        as they are needed.
+
+        :param ident: content id or (content id and subtopic id)
+        :type ident: ``str`` or ``(str, str)``
+        :rtype: generator of :class:`Label`
+        '''
+        return self.clique(ident).expanded_labels()
+
+    def expand_count(self, ident):
+        '''Count the labels :meth:`expand` would return.
+
+        This does not construct any inferred labels.
+
+        :param ident: content id or (content id and subtopic id)
+        :type ident: ``str`` or ``(str, str)``
+        :rtype: int
+        '''
+        return self.clique(ident).expanded_count()
+
+    def expanded_pairs(self, ident):
+        '''Return a generator of coreferent pairs in a component.
+
+        This yields every unordered pair of distinct idents in the
+        connected component of ``ident``, whether or not there is a
+        label between them, once each.  If ``ident`` is a content ID
+        then the pairs are of content IDs; otherwise they are of
+        ``(content_id, subtopic_id)`` pairs.
+
+        :param ident: content id or (content id and subtopic id)
+        :type ident: ``str`` or ``(str, str)``
+        :rtype: generator of ``(ident, ident)``
+        '''
+        return self.clique(ident).pairs()
+
+    def negative_inference(self, content_id, components=None):
+        '''Return a generator of inferred negative label relationships
+        centered on ``content_id``.
+
+        Negative labels are inferred by getting all other content ids
+        connected to ``content_id`` through a negative label, then
+        running :meth:`LabelStore.negative_label_inference` on those
+        labels. See :meth:`LabelStore.negative_label_inference` for
+        more information.
+
+        Each positive connected component is only traversed once per
+        call, even if several negative labels touch it.  `components`
+        may be a dictionary to share that work across calls; see
+        :meth:`negative_label_inference`.
+        '''
+        if components is None:
+            components = {}
+        neg_labels = ifilter(lambda l: l.value == CorefValue.Negative,
+                             self.directly_connected(content_id))
+        for label in neg_labels:
+            label_inf = self.negative_label_inference(label, components)
+            for label in label_inf:
+                yield label
+
+    def negative_inference_many(self, content_ids, batch_size=1000):
+        '''Run :meth:`negative_inference` on many content IDs.
+
+        The labels directly connected to `content_ids` are fetched
+        `batch_size` content IDs at a time, concurrently if the
+        :class:`LabelStore` has `scan_clients`, and every positive
+        connected component found is kept for the whole call, so
+        each is traversed only once.  Memory use is proportional to
+        the total size of the components touched.
+
+        :param content_ids: iterable of content IDs
+        :param int batch_size: number of content IDs per batch
+        :return: generator of ``(content_id, labels)`` pairs, where
+          `labels` is a list of what :meth:`negative_inference` would
+          yield for `content_id`
+        '''
+        components = {}
+        content_ids = iter(content_ids)
+        while True:
+            batch = list(islice(content_ids, batch_size))
+            if not batch:
+                break
+            connected = self._directly_connected_many(
+                set((content_id, None) for content_id in batch))
+            for content_id in batch:
+                labels = []
+                for label in connected[(content_id, None)]:
+                    if label.value == CorefValue.Negative:
+                        labels.extend(self.negative_label_inference(
+                            label, components))
+                yield content_id, labels
+
+    def negative_label_inference(self, label, components=None):
+        '''Return a generator of inferred negative label relationships.
+
+        Construct ad-hoc negative labels between ``label.content_id1``
+        and the positive connected component of ``label.content_id2``,
+        and ``label.content_id2`` to the connected component of
+        ``label.content_id1``.
+
+        Note this will allocate memory proportional to the size of the
+        connected components of ``label.content_id1`` and
+        ``label.content_id2``.
+
+        If `components` is provided, it is a dictionary mapping content
+        IDs to their :class:`Clique`, which is consulted before
+        finding a connected component and updated afterwards for every
+        member of the component.  It must be discarded if labels are
+        added to the store.
+        '''
+        assert label.value == CorefValue.Negative
+
+        yield label
+
+        cid2_comp = self._cached_clique(label.content_id2, components)
+        for cid in cid2_comp:
+            if cid != label.content_id2:
+                yield Label(label.content_id1, cid, 'auto',
+                            CorefValue.Negative)
+
+        cid1_comp = self._cached_clique(label.content_id1, components)
+        for cid in cid1_comp:
+            if cid != label.content_id1:
+                yield Label(label.content_id2, cid, 'auto',
+                            CorefValue.Negative)
+
+    def _cached_clique(self, content_id, components):
+        '''Get the :meth:`clique` of `content_id` through `components`.'''
+        if components is None:
+            return self.clique(content_id)
+        clique = components.get(content_id)
+        if clique is None:
+            clique = self.clique(content_id)
+            for member in clique:
+                components[member] = clique
+        return clique
+
+    def find_conflicts(self, subtopic=False):
+        '''Return a generator of negative labels inside a component.
+
+        A negative label conflicts with the positive labels if both of
+        its idents are in the same :meth:`connected_component`.  This
+        reads every current label twice: the first pass finds the
+        positive components of the whole store, holding only the
+        idents in memory, and the second yields each negative label
+        that joins two different idents of one component.  The
+        labels carry their annotator and time.
+
+        :param bool subtopic: if true, compare ``(content_id,
+          subtopic_id)`` idents; otherwise compare content ids
+        :rtype: generator of :class:`Label`
+        '''
+        components = _UnionFind()
+        for label in self.everything():
+            if label.value == CorefValue.Positive:
+                components.union(*idents_from_label(label, subtopic=subtopic))
+        for label in self.everything():
+            if label.value != CorefValue.Negative:
+                continue
+            ident1, ident2 = idents_from_label(label, subtopic=subtopic)
+            if ident1 != ident2 and \
+                    components.find(ident1) == components.find(ident2):
+                yield label
+
+
+class LabelStore(_LabelQueries):
     '''A label database.
 
     .. automethod:: __init__
     .. automethod:: put
+    .. automethod:: put_many
     .. automethod:: get
+    .. automethod:: get_many
     .. automethod:: directly_connected
     .. automethod:: connected_component
+    .. automethod:: are_coreferent
     .. automethod:: expand
+    .. automethod:: clique
+    .. automethod:: iter_expand
+    .. automethod:: expand_count
+    .. automethod:: expanded_pairs
+    .. automethod:: negative_inference
+    .. automethod:: negative_inference_many
+    .. automethod:: negative_label_inference
+    .. automethod:: find_conflicts
     .. automethod:: everything
+    .. automethod:: everything_batches
+    .. automethod:: by_annotator
+    .. automethod:: labels_since
+    .. automethod:: compact
+    .. automethod:: cluster_of
+    .. automethod:: members
+    .. automethod:: rebuild_cluster_index
+    .. automethod:: rebuild_subtopic_index
+    .. automethod:: rebuild_annotator_index
+    .. automethod:: rebuild_change_log
+    .. automethod:: migrate_layout
     .. automethod:: delete_all
     '''
     config_name = 'dossier.label'
@@ -400,15 +817,162 @@ class LabelStore(object):
         TABLE: (str, str, str, str, str, long),
     }
 
-    def __init__(self, kvlclient):
+    CLUSTER_TABLE = 'label_cluster'
+    CLUSTER_MEMBERS_TABLE = 'label_cluster_members'
+
+    SUBTOPIC_TABLE = 'label_subtopic'
+
+    _subtopic_namespace = {
+        # (cid1, subid1, cid2, subid2, annotator_id, time) -> value
+        SUBTOPIC_TABLE: (str, str, str, str, str, long),
+    }
+
+    ANNOTATOR_TABLE = 'label_annotator'
+
+    _annotator_namespace = {
+        # (annotator_id, time, cid1, cid2, subid1, subid2) -> value
+        # N.B. Unlike the other tables, time here is the epoch ticks
+        # themselves, so that labels are in chronological order.
+        ANNOTATOR_TABLE: (str, long, str, str, str, str),
+    }
+
+    LOG_TABLE = 'label_log'
+
+    _log_namespace = {
+        # (time, sequence, cid1, cid2, subid1, subid2, annotator_id) -> value
+        # Time is the epoch ticks themselves, as in ANNOTATOR_TABLE.
+        # Sequence orders the labels with the same time by when they
+        # were written; see _write_sequence().
+        LOG_TABLE: (long, long, str, str, str, str, str),
+    }
+
+    REVERSE_TABLE = 'label_reverse'
+
+    _reverse_namespace = {
+        # (cid2, cid1) -> '', for every pair in TABLE with cid1 < cid2
+        REVERSE_TABLE: (str, str),
+    }
+
+    _cluster_namespace = {
+        # (content_id,) -> root content_id of its cluster
+        CLUSTER_TABLE: (str,),
+        # (root content_id, member content_id) -> ''
+        CLUSTER_MEMBERS_TABLE: (str, str),
+    }
+
+    def __init__(self, kvlclient, cache=None, cluster_index=False,
+                 subtopic_index=False, annotator_index=False,
+                 change_log=False, layout='dual', intern_ids=False,
+                 scan_clients=()):
         '''Create a new label store.
 
+        If `cache` is provided, the results of :meth:`get` and
+        :meth:`directly_connected` are kept in it, and labels written
+        through this store invalidate the affected entries.
+
+        If `cluster_index` is :const:`True`, the store also maintains
+        a persistent index of positive content ID clusters; see
+        :meth:`cluster_of`.  Every process writing labels must enable
+        it, or it must be rebuilt with :meth:`rebuild_cluster_index`.
+        The index is updated by reading and rewriting its rows for
+        each batch of labels written, so it is only kept correct when
+        one process writes labels at a time; after concurrent writes,
+        rebuild it.
+
+        If `subtopic_index` is :const:`True`, every label is also
+        written to a table keyed by content ID and subtopic ID, and
+        queries for a ``(content_id, subtopic_id)`` ident read only
+        the rows for that subtopic.  As with the cluster index, every
+        writer must enable it, or it must be rebuilt with
+        :meth:`rebuild_subtopic_index`.
+
+        If `annotator_index` is :const:`True`, every label is also
+        written to a table keyed by annotator ID and time, which
+        :meth:`by_annotator` reads.  It can be populated for existing
+        labels with :meth:`rebuild_annotator_index`.
+
+        If `change_log` is :const:`True`, every label is also written
+        to a table keyed by time, which :meth:`labels_since` reads.
+        It can be populated for existing labels with
+        :meth:`rebuild_change_log`.
+
+        `layout` selects how labels are stored.  With ``'dual'``,
+        every label is written twice, once in each content ID order,
+        so either content ID can be scanned directly.  With
+        ``'single'``, every label is written once, in its natural
+        order, and a small reverse index maps the second content ID
+        of each pair to the first; lookups by the second content ID
+        go through the reverse index.  This halves the size of the
+        label table and the rows read by a scan of :meth:`everything`,
+        but makes lookups by content ID dearer.  In the dual layout,
+        looking up one content ID is one key range; in the single
+        layout it is one range of the label table, one of the reverse
+        index, and one more of the label table for every content ID
+        that was the first of a pair with it.  With most
+        :mod:`kvlayer` backends each range is its own query, so a
+        content ID with many such neighbors is much slower to read,
+        as is everything built on those lookups, such as
+        :meth:`directly_connected` and :meth:`connected_component`.
+        Every process using a store must use the same layout; see
+        :meth:`migrate_layout` to convert an existing store.
+
+        If `intern_ids` is :const:`True`, the content, subtopic and
+        annotator IDs of labels read from the store are interned, so
+        every label and search with the same ID shares one string.
+        This saves memory when many labels are held at once, as in a
+        large connected component or a full scan, at a small cost
+        per label read.
+
+        `scan_clients` are more :mod:`kvlayer` clients for the same
+        namespace as `kvlclient`.  Most :mod:`kvlayer` backends send
+        one query per key range, so looking up many idents at once,
+        as each breadth-first level of :meth:`connected_component`
+        does, makes one query per ident.  With `scan_clients`, the
+        ranges of such a lookup are split between `kvlclient` and
+        `scan_clients` and scanned concurrently, one thread per
+        client.  A :mod:`kvlayer` client must not be used by two
+        threads at once, so each must be its own client, and none
+        may be used elsewhere while the store is in use.
+
         :param kvlclient: kvlayer client
         :type kvlclient: :class:`kvlayer._abstract_storage.AbstractStorage`
+        :param cache: optional read-through cache
+        :type cache: :class:`dossier.label.cache.LabelCache`
+        :param bool cluster_index: maintain the cluster index
+        :param bool subtopic_index: maintain and use the subtopic index
+        :param bool annotator_index: maintain the annotator index
+        :param bool change_log: maintain the change log
+        :param str layout: ``'dual'`` or ``'single'``
+        :param bool intern_ids: intern IDs of labels read
+        :param scan_clients: more kvlayer clients for concurrent scans
         :rtype: :class:`LabelStore`
         '''
+        if layout not in ('dual', 'single'):
+            raise ValueError('layout must be "dual" or "single", not {0!r}'
+                             .format(layout))
         self.kvl = kvlclient
-        self.kvl.setup_namespace(self._kvlayer_namespace)
+        self.scan_clients = list(scan_clients)
+        namespaces = [self._kvlayer_namespace]
+        self.cache = cache
+        self.cluster_index = cluster_index
+        if self.cluster_index:
+            namespaces.append(self._cluster_namespace)
+        self.subtopic_index = subtopic_index
+        if self.subtopic_index:
+            namespaces.append(self._subtopic_namespace)
+        self.annotator_index = annotator_index
+        if self.annotator_index:
+            namespaces.append(self._annotator_namespace)
+        self.change_log = change_log
+        if self.change_log:
+            namespaces.append(self._log_namespace)
+        self.layout = layout
+        if self.layout == 'single':
+            namespaces.append(self._reverse_namespace)
+        self.intern_ids = intern_ids
+        for client in [self.kvl] + self.scan_clients:
+            for namespace in namespaces:
+                client.setup_namespace(namespace)
 
     def put(self, label):
         '''Add a new label to the store.
@@ -416,22 +980,153 @@ class LabelStore(object):
         :param label: label
         :type label: :class:`Label`
         '''
+        self.put_many([label])
+
+    def put_many(self, labels, batch_size=1000):
+        '''Add many labels to the store.
+
+        This is equivalent to calling :meth:`put` on each label in
+        `labels`, but the rows are sent to :mod:`kvlayer` in chunks
+        of `batch_size` labels, with one :mod:`kvlayer` ``put`` call
+        per table for each chunk.  How much that saves depends on the
+        backend: some write a call's rows together, but others, such
+        as PostgreSQL, still write each row with its own statement.
+        `labels` may be any iterable, including a generator; at most
+        one chunk is held in memory at a time.
+
+        :param labels: labels to store
+        :type labels: iterable of :class:`Label`
+        :param int batch_size: number of labels per :mod:`kvlayer` call
+        :return: number of labels stored
+        :rtype: int
+
+        '''
+        if batch_size < 1:
+            raise ValueError('batch_size must be positive, not {0!r}'
+                             .format(batch_size))
+        count = 0
+        batch = []
+        for label in labels:
+            batch.append(label)
+            count += 1
+            if len(batch) == batch_size:
+                self._put_batch(batch)
+                batch = []
+        if batch:
+            self._put_batch(batch)
+        return count
+
+    def _put_batch(self, labels):
+        '''Write the rows for `labels`, one :mod:`kvlayer` call per table.'''
+        rows = {}
+        for label in labels:
+            for table, row in self._rows_from_label(label):
+                rows.setdefault(table, []).append(row)
+        # Write the primary table last, so that a label is never
+        # visible before its index rows are
+        for table, table_rows in rows.iteritems():
+            if table != self.TABLE:
+                self.kvl.put(table, *table_rows)
+        self.kvl.put(self.TABLE, *rows[self.TABLE])
+        self._after_put(labels)
+
+    def _after_put(self, labels):
+        '''Update derived state after `labels` have been written.
+
+        This drops cached results that `labels` may have changed and
+        updates the cluster index.
+
+        '''
+        if self.cache is not None:
+            content_ids = set()
+            for label in labels:
+                content_ids.add(label.content_id1)
+                content_ids.add(label.content_id2)
+            self.cache.invalidate(content_ids)
+        if self.cluster_index:
+            self._cluster_update(labels)
 
-        # Store `label` under both normal and swapped key tuples,
-        # so that we can efficiently find c2<->c1 labels
-        k1 = (label.content_id1, label.content_id2,
-              label.subtopic_id1, label.subtopic_id2,
-              label.annotator_id, time_complement(label.epoch_ticks))
-        k2 = (label.content_id2, label.content_id1,
-              label.subtopic_id2, label.subtopic_id1,
-              label.annotator_id, time_complement(label.epoch_ticks))
+    def _rows_from_label(self, label):
+        '''Make the kvlayer rows for a label.
+
+        Returns a list of ``(table, (key, value))`` pairs, for
+        :attr:`TABLE` and for every enabled index.
+
+        '''
+        k = (label.content_id1, label.content_id2,
+             label.subtopic_id1, label.subtopic_id2,
+             label.annotator_id, time_complement(label.epoch_ticks))
 
         # Pack value and rating into a single byte, since both will likely
         # be small integers
         to_pack = (label.value.value+1) | (label.rating << 4)
         v = struct.pack('B', to_pack)
 
-        self.kvl.put(self.TABLE, (k1, v), (k2, v))
+        return self._rows_from_key(k, v)
+
+    def _rows_from_key(self, k1, v):
+        '''Make the kvlayer rows for a label from its natural key.
+
+        `k1` is the :attr:`TABLE` key of the label in its natural
+        order, and `v` its packed value.  Returns the same thing as
+        :meth:`_rows_from_label`.
+
+        '''
+        k2 = self._swapped_key(k1)
+        if self.layout == 'dual':
+            # Store `label` under both normal and swapped key tuples,
+            # so that we can efficiently find c2<->c1 labels
+            rows = [(self.TABLE, (k1, v)), (self.TABLE, (k2, v))]
+        else:
+            rows = [(self.TABLE, (k1, v))]
+            if k1[0] != k1[1]:
+                rows.append((self.REVERSE_TABLE, ((k1[1], k1[0]), '')))
+        if self.subtopic_index:
+            rows.append((self.SUBTOPIC_TABLE, (self._subtopic_key(k1), v)))
+            if k1 != k2:
+                rows.append((self.SUBTOPIC_TABLE,
+                             (self._subtopic_key(k2), v)))
+        if self.annotator_index:
+            rows.append((self.ANNOTATOR_TABLE, (self._annotator_key(k1), v)))
+        if self.change_log:
+            rows.append((self.LOG_TABLE,
+                         (self._log_key(k1, _write_sequence()), v)))
+        return rows
+
+    @staticmethod
+    def _swapped_key(k):
+        '''Swap the two sides of a :attr:`TABLE` key.'''
+        return (k[1], k[0], k[3], k[2], k[4], k[5])
+
+    @staticmethod
+    def _annotator_key(k):
+        '''Convert a :attr:`TABLE` key to an :attr:`ANNOTATOR_TABLE` key.'''
+        return (k[4], time_complement(k[5]), k[0], k[1], k[2], k[3])
+
+    @staticmethod
+    def _key_from_annotator_key(k):
+        '''Convert an :attr:`ANNOTATOR_TABLE` key to a :attr:`TABLE` key.'''
+        return (k[2], k[3], k[4], k[5], k[0], time_complement(k[1]))
+
+    @staticmethod
+    def _log_key(k, sequence):
+        '''Convert a :attr:`TABLE` key to a :attr:`LOG_TABLE` key.'''
+        return (time_complement(k[5]), sequence, k[0], k[1], k[2], k[3], k[4])
+
+    @staticmethod
+    def _key_from_log_key(k):
+        '''Convert a :attr:`LOG_TABLE` key to a :attr:`TABLE` key.'''
+        return (k[2], k[3], k[4], k[5], k[6], time_complement(k[0]))
+
+    @staticmethod
+    def _subtopic_key(k):
+        '''Convert between :attr:`TABLE` and :attr:`SUBTOPIC_TABLE` keys.
+
+        The conversion swaps the second and third parts of the key,
+        so it is its own inverse.
+
+        '''
+        return (k[0], k[2], k[1], k[3], k[4], k[5])
 
     def get(self, cid1, cid2, annotator_id, subid1='', subid2=''):
         '''Retrieve a label from the store.
@@ -453,15 +1148,87 @@ class LabelStore(object):
         :raises: :exc:`KeyError` if no label could be found.
 
         '''
-        t = (cid1, cid2, subid1, subid2, annotator_id)
+        t = self._key_prefix(cid1, cid2, annotator_id, subid1, subid2)
+        labels = self._cache_get(('get', t))
+        if labels is None:
+            labels = []
+            # We take the first result because the `kvlayer` abstraction
+            # guarantees that the first result will be the most recent
+            # entry for this particular key (since the timestamp is
+            # inserted as a complement value).
+            for k, v in self.kvl.scan(self.TABLE, (t, t)):
+                labels.append(self._label_from_kvlayer(k, v))
+                break
+            self._cache_put(('get', t), labels, t[:2])
+        if not labels:
+            raise KeyError(t)
+        return labels[0]
+
+    def get_many(self, keys, default=None, batch_size=1000):
+        '''Retrieve many labels from the store.
+
+        Each of `keys` is a tuple of the positional parameters to
+        :meth:`get`, either ``(cid1, cid2, annotator_id)`` or
+        ``(cid1, cid2, annotator_id, subid1, subid2)``.  Duplicate
+        lookups, including the same pair in the other order, are
+        merged.  Lookups of the same pair of content IDs with
+        different annotator or subtopic IDs share one range, which
+        covers every label of the pair; the rows that were not asked
+        for are dropped.  Up to `batch_size` ranges are sent to
+        :mod:`kvlayer` at a time.  Most backends send one query per
+        range, which are run concurrently if the store has
+        `scan_clients`.
+
+        The result is a dictionary mapping each of `keys` to the most
+        recent matching :class:`Label`, as :meth:`get` would return,
+        or to `default` if there is no such label.
+
+        :param keys: lookup tuples
+        :param default: value for keys with no label
+        :param int batch_size: maximum number of ranges per scan
+        :rtype: dict
 
-        # We return the first result because the `kvlayer` abstraction
-        # guarantees that the first result will be the most recent entry
-        # for this particular key (since the timestamp is inserted as a
-        # complement value).
-        for k, v in self.kvl.scan(self.TABLE, (t, t)):
-            return self._label_from_kvlayer(k, v)
-        raise KeyError(t)
+        '''
+        if batch_size < 1:
+            raise ValueError('batch_size must be positive, not {0!r}'
+                             .format(batch_size))
+        by_prefix = {}
+        for key in keys:
+            by_prefix.setdefault(self._key_prefix(*key), []).append(key)
+
+        result = {}
+        for t in by_prefix.keys():
+            labels = self._cache_get(('get', t))
+            if labels is not None:
+                for key in by_prefix.pop(t):
+                    result[key] = labels[0] if labels else default
+
+        by_pair = {}
+        for t in by_prefix:
+            by_pair.setdefault(t[:2], []).append(t)
+        ranges = []
+        for pair, pair_prefixes in sorted(by_pair.iteritems()):
+            if len(pair_prefixes) == 1:
+                ranges.append((pair_prefixes[0], pair_prefixes[0]))
+            else:
+                ranges.append((pair, pair))
+        for k, v in self._scan_ranges(self.TABLE, ranges, batch_size):
+            # Rows with the same prefix are newest first, so the
+            # first row we see for a prefix is the answer for it.  A
+            # range for a whole pair also has rows nobody asked for,
+            # which are skipped here.
+            t = k[:5]
+            if t not in by_prefix:
+                continue
+            label = self._label_from_kvlayer(k, v)
+            self._cache_put(('get', t), [label], t[:2])
+            for key in by_prefix.pop(t):
+                result[key] = label
+        for t, missing in by_prefix.iteritems():
+            self._cache_put(('get', t), [], t[:2])
+            for key in missing:
+                result[key] = default
+        return result
 
     def _label_from_kvlayer(self, k, v):
         '''Make a label from a kvlayer row.'''
@@ -469,16 +1236,23 @@ class LabelStore(object):
          annotator_id, inverted_epoch_ticks) = k
         epoch_ticks = time_complement(inverted_epoch_ticks)
         (unpacked,) = struct.unpack('B', v)
-        value = (unpacked & 15) - 1
+        value = _COREF_VALUES[(unpacked & 15) - 1]
         rating = (unpacked >> 4)
-        return Label(content_id1=content_id1,
-                     content_id2=content_id2,
-                     annotator_id=annotator_id,
-                     value=value,
-                     subtopic_id1=subtopic_id1,
-                     subtopic_id2=subtopic_id2,
-                     epoch_ticks=epoch_ticks,
-                     rating=rating)
+        # Rows scanned by content ID may be in swapped order, but
+        # nothing else about a stored label needs fixing
+        if ((content_id2 < content_id1 or
+             (content_id2 == content_id1 and subtopic_id2 < subtopic_id1))):
+            content_id1, content_id2 = content_id2, content_id1
+            subtopic_id1, subtopic_id2 = subtopic_id2, subtopic_id1
+        if self.intern_ids:
+            content_id1 = intern(content_id1)
+            content_id2 = intern(content_id2)
+            subtopic_id1 = intern(subtopic_id1)
+            subtopic_id2 = intern(subtopic_id2)
+            annotator_id = intern(annotator_id)
+        return Label._from_trusted(content_id1, content_id2, annotator_id,
+                                   value, subtopic_id1, subtopic_id2,
+                                   epoch_ticks, rating)
 
     def directly_connected(self, ident):
         '''Return a generator of labels connected to ``ident``.
@@ -497,124 +1271,99 @@ class LabelStore(object):
         :rtype: generator of :class:`Label`
         '''
         content_id, subtopic_id = normalize_ident(ident)
-        return self.everything(include_deleted=False,
-                               content_id=content_id,
-                               subtopic_id=subtopic_id)
-
-    def connected_component(self, ident):
-        '''Return a connected component generator for ``ident``.
-
-        ``ident`` may be a ``content_id`` or a ``(content_id,
-        subtopic_id)``.
-
-        Given an ``ident``, return the corresponding connected
-        component by following all positive transitivity relationships.
-
-        For example, if ``(a, b, 1)`` is a label and ``(b, c, 1)`` is
-        a label, then ``connected_component('a')`` will return both
-        labels even though ``a`` and ``c`` are not directly connected.
+        if self.cache is None:
+            return self.everything(include_deleted=False,
+                                   content_id=content_id,
+                                   subtopic_id=subtopic_id)
+        ident = (content_id, subtopic_id)
+        return iter(self._directly_connected_many([ident])[ident])
+
+    def _directly_connected_many(self, idents):
+        '''Find the labels directly connected to several idents.
+
+        `idents` must be normalized ``(content_id, subtopic_id)``
+        pairs.  The idents that are not cached are looked up with
+        multi-range scans.  Returns a dictionary mapping each
+        ident to a list of labels, as :meth:`directly_connected`
+        would return.
 
-        (Note that even though this returns a generator, it will still
-        consume memory proportional to the number of labels in the
-        connected component.)
-
-        :param ident: content id or (content id and subtopic id)
-        :type ident: ``str`` or ``(str, str)``
-        :rtype: generator of :class:`Label`
         '''
-        ident = normalize_ident(ident)
-        done = set()  # set of cids that we've queried with
-        todo = set([ident])  # set of cids to do a query for
-        label_hashes = set()
-        while todo:
-            ident = todo.pop()
-            done.add(ident)
-            for label in self.directly_connected(ident):
-                if label.value != CorefValue.Positive:
-                    continue
-                ident1, ident2 = idents_from_label(
-                    label, subtopic=ident_has_subtopic(ident))
-                if ident1 not in done:
-                    todo.add(ident1)
-                if ident2 not in done:
-                    todo.add(ident2)
-
-                h = hash(label)
-                if h not in label_hashes:
-                    label_hashes.add(h)
-                    yield label
-
-    def expand(self, ident):
-        '''Return expanded set of labels from a connected component.
-
-        The connected component is derived from ``ident``. ``ident``
-        may be a ``content_id`` or a ``(content_id, subtopic_id)``.
-        If ``ident`` identifies a subtopic, then expansion is done
-        on a subtopic connected component (and expanded labels retain
-        subtopic information).
-
-        The labels returned by :meth:`LabelStore.connected_component`
-        contains only the :class:`Label` stored in the
-        :class:`LabelStore`, and does not include the labels you can
-        infer from the connected component. This method returns both
-        the data-backed labels and the inferred labels.
-
-        Subtopic assignments of the expanded labels will be empty. The
-        ``annotator_id`` will be an arbitrary ``annotator_id`` within
-        the connected component.
+        result = {}
+        missing = []
+        for ident in idents:
+            labels = self._cache_get(('directly_connected',) + ident)
+            if labels is None:
+                missing.append(ident)
+            else:
+                result[ident] = labels
+        if not missing:
+            return result
+
+        if self.subtopic_index:
+            by_subtopic = [ident for ident in missing if ident[1] is not None]
+            by_content = [ident for ident in missing if ident[1] is None]
+        else:
+            by_subtopic = []
+            by_content = missing
+        rows = self._scan_content_ids(set(cid for cid, _ in by_content))
+        rows.update(self._scan_subtopics(by_subtopic))
+        for ident in missing:
+            content_id, subtopic_id = ident
+            if ident in rows:
+                ident_rows = rows[ident]
+            else:
+                ident_rows = rows[content_id]
+            labels = list(self._labels_from_rows(
+                ident_rows, include_deleted=False,
+                content_id=content_id, subtopic_id=subtopic_id))
+            self._cache_put(('directly_connected',) + ident, labels,
+                            (content_id,))
+            result[ident] = labels
+        return result
+
+    def _scan_content_ids(self, content_ids, batch_size=1000):
+        '''Get the rows for several content IDs.
+
+        The rows are fetched with multi-range scans of up to
+        `batch_size` content IDs each.  Returns a dictionary mapping
+        each content ID to a list of its ``(key, value)`` rows in key
+        order, as a scan of that content ID alone would return them.
 
-        :param str content_id: content id
-        :param value: coreferent value
-        :type value: :class:`CorefValue`
-        :rtype: ``list`` of :class:`Label`
         '''
-        subtopic = ident_has_subtopic(normalize_ident(ident))
-        labels = list(self.connected_component(ident))
-        labels.extend(expand_labels(labels, subtopic=subtopic))
-        return labels
-
-    def negative_inference(self, content_id):
-        '''Return a generator of inferred negative label relationships
-        centered on ``content_id``.
+        rows = dict((content_id, []) for content_id in content_ids)
+        ranges = [((content_id,), (content_id,))
+                  for content_id in sorted(rows)]
+        for k, v in self._scan_ranges(self.TABLE, ranges, batch_size):
+            rows[k[0]].append((k, v))
+        if self.layout == 'single':
+            self._scan_reverse(rows, batch_size)
+        return rows
+
+    def _scan_reverse(self, rows, batch_size):
+        '''Add the rows found through the reverse index to `rows`.
+
+        `rows` is a dictionary as :meth:`_scan_content_ids` returns,
+        holding the rows scanned directly for each content ID.  The
+        labels where each content ID is the second of the pair are
+        added to it, with their keys swapped, as are the swapped
+        rows of labels between two subtopics of the same content ID,
+        as if they had been stored in the dual layout.  Swapped rows
+        that are still in the table from before :meth:`migrate_layout`
+        are merged with these.
 
-        Negative labels are inferred by getting all other content ids
-        connected to ``content_id`` through a negative label, then
-        running :meth:`LabelStore.negative_label_inference` on those
-        labels. See :meth:`LabelStore.negative_label_inference` for
-        more information.
         '''
-        neg_labels = ifilter(lambda l: l.value == CorefValue.Negative,
-                             self.directly_connected(content_id))
-        for label in neg_labels:
-            label_inf = self.negative_label_inference(label)
-            for label in label_inf:
-                yield label
-
-    def negative_label_inference(self, label):
-        '''Return a generator of inferred negative label relationships.
-
-        Construct ad-hoc negative labels between ``label.content_id1``
-        and the positive connected component of ``label.content_id2``,
-        and ``label.content_id2`` to the connected component of
-        ``label.content_id1``.
-
-        Note this will allocate memory proportional to the size of the
-        connected components of ``label.content_id1`` and
-        ``label.content_id2``.
-        '''
-        assert label.value == CorefValue.Negative
-
-        yield label
-
-        cid2_comp = self.connected_component(label.content_id2)
-        for comp_label in cid2_comp:
-            cid = comp_label.other(label.content_id2)
-            yield Label(label.content_id1, cid, 'auto', CorefValue.Negative)
-
-        cid1_comp = self.connected_component(label.content_id1)
-        for comp_label in cid1_comp:
-            cid = comp_label.other(label.content_id1)
-            yield Label(label.content_id2, cid, 'auto', CorefValue.Negative)
+        ranges = [((content_id,), (content_id,))
+                  for content_id in sorted(rows)]
+        pairs = sorted((k[1], k[0]) for k in self._scan_ranges(
+            self.REVERSE_TABLE, ranges, batch_size, keys_only=True))
+        ranges = [(pair, pair) for pair in pairs]
+        for k, v in self._scan_ranges(self.TABLE, ranges, batch_size):
+            rows[k[1]].append((self._swapped_key(k), v))
+        for content_id, content_rows in rows.iteritems():
+            content_rows.extend([(self._swapped_key(k), v)
+                                 for k, v in content_rows if k[0] == k[1]])
+            # Sort back into key order, dropping duplicates
+            rows[content_id] = sorted(dict(content_rows).iteritems())
 
     def _filter_keys(self, content_id=None, subtopic_id=None):
         '''Filter out-of-order labels by key tuple.
@@ -628,15 +1377,14 @@ class LabelStore(object):
         dual will not be in the query at all.
 
         '''
+        if content_id is None:
+            # We're scanning everything, so accept the label if
+            # it's the natural order; l.content_id1 == cid1
+            return _natural_row
+
         def accept(kvp):
             (content_id1, content_id2, subtopic_id1, subtopic_id2,
              annotator_id, inverted_epoch_ticks) = kvp[0]
-            if content_id is None:
-                # We're scanning everything, so accept the label if
-                # it's the natural order; l.content_id1 == cid1
-                return (content_id1 < content_id2 or
-                        (content_id1 == content_id2 and
-                         subtopic_id1 <= subtopic_id2))
             assert content_id1 == content_id  # because that's the scan range
             # If we're not looking for subtopic IDs, then accept records
             # matching the content ID that are in natural order
@@ -645,14 +1393,11 @@ class LabelStore(object):
                     return True  # will never see its dual
                 return subtopic_id1 <= subtopic_id2
             # The scan range doesn't include subtopic IDs (the key schema
-            # is oriented towards querying content-to-content labels)
-            # so we need to accept records where either part matches
-            # (if both parts match then the record is its own dual)
-            if subtopic_id == subtopic_id1:
-                return True
-            if content_id == content_id2 and subtopic_id == subtopic_id2:
-                return True
-            return False
+            # is oriented towards querying content-to-content labels),
+            # so check the subtopic on our side of the record.  A label
+            # between two subtopics of `content_id` is in the scan in
+            # both orders, and this accepts exactly one of them.
+            return subtopic_id == subtopic_id1
         return accept
 
     def everything(self, include_deleted=False, content_id=None,
@@ -671,20 +1416,836 @@ class LabelStore(object):
         :rtype: generator of :class:`Label`
 
         '''
-        if content_id is not None:
-            ranges = [((content_id,), (content_id,))]
+        if content_id is None:
+            return starmap(self._label_from_kvlayer,
+                           self._scan_all(include_deleted))
+        elif subtopic_id is not None and self.subtopic_index:
+            t = (content_id, subtopic_id)
+            rows = imap(lambda p: (self._subtopic_key(p[0]), p[1]),
+                        self.kvl.scan(self.SUBTOPIC_TABLE, (t, t)))
+        elif self.layout == 'single':
+            rows = self._scan_content_ids([content_id])[content_id]
         else:
-            ranges = []
-        labels = self.kvl.scan(self.TABLE, *ranges)
-        labels = ifilter(self._filter_keys(content_id, subtopic_id), labels)
+            rows = self.kvl.scan(self.TABLE, ((content_id,), (content_id,)))
+        return self._labels_from_rows(rows, include_deleted=include_deleted,
+                                      content_id=content_id,
+                                      subtopic_id=subtopic_id)
+
+    def everything_batches(self, batch_size=10000, include_deleted=False):
+        '''Return a generator of all labels in the store, in batches.
+
+        This returns the same labels in the same order as
+        :meth:`everything` with no `content_id`, but as
+        :class:`~dossier.label.batch.LabelBatch` objects of up to
+        `batch_size` labels each, filled directly from the stored
+        rows without creating a :class:`Label` for each.
+
+        :param int batch_size: maximum number of labels per batch
+        :param bool include_deleted: include superseded labels
+        :rtype: generator of :class:`~dossier.label.batch.LabelBatch`
+
+        '''
+        from dossier.label.batch import LabelBatch
+        if batch_size < 1:
+            raise ValueError('batch_size must be positive, not {0!r}'
+                             .format(batch_size))
+        batch = LabelBatch()
+        for k, v in self._scan_all(include_deleted):
+            (unpacked,) = struct.unpack('B', v)
+            batch._append(k[0], k[1], k[2], k[3], k[4],
+                          time_complement(k[5]), (unpacked & 15) - 1,
+                          unpacked >> 4)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = LabelBatch()
+        if len(batch) > 0:
+            yield batch
+
+    def _scan_all(self, include_deleted):
+        '''Get the natural order rows of every label.
+
+        The swapped and superseded rows are dropped before any labels
+        are made from them, since they are most of a full scan.
+
+        '''
+        rows = ifilter(_natural_row, self.kvl.scan(self.TABLE))
+        if not include_deleted:
+            rows = _most_recent_rows(rows)
+        return rows
+
+    def _scan_subtopics(self, idents, batch_size=1000):
+        '''Get the rows for several subtopics from the subtopic index.
+
+        `idents` are ``(content_id, subtopic_id)`` pairs.  Returns a
+        dictionary mapping each ident to a list of its rows, with keys
+        converted to :attr:`TABLE` order with `content_id` first, as a
+        scan of `content_id` in :attr:`TABLE` would return them.
+
+        '''
+        rows = dict((ident, []) for ident in idents)
+        ranges = [(ident, ident) for ident in sorted(rows)]
+        for k, v in self._scan_ranges(self.SUBTOPIC_TABLE, ranges,
+                                      batch_size):
+            rows[k[:2]].append((self._subtopic_key(k), v))
+        return rows
+
+    def _scan_ranges(self, table, ranges, batch_size=1000, keys_only=False):
+        '''Scan many key ranges of `table`.
+
+        The ranges are sent `batch_size` at a time.  Without
+        :attr:`scan_clients`, each batch is one :mod:`kvlayer` scan;
+        with them, each batch is split into contiguous parts, which
+        are scanned at the same time by one thread per client.  The
+        rows of every range are generated in the order of `ranges`.
+        If `keys_only` is true, only the keys are generated.
+
+        '''
+        for start in xrange(0, len(ranges), batch_size):
+            batch = ranges[start:start + batch_size]
+            if not self.scan_clients or len(batch) == 1:
+                scans = [_scan(self.kvl, table, batch, keys_only)]
+            else:
+                scans = _concurrent_scans([self.kvl] + self.scan_clients,
+                                          table, batch, keys_only)
+            for rows in scans:
+                for row in rows:
+                    yield row
+
+    def _labels_from_rows(self, rows, include_deleted=False, content_id=None,
+                          subtopic_id=None):
+        '''Turn scanned rows into labels, as :meth:`everything` does.
+
+        `rows` are ``(key, value)`` pairs from a scan of
+        :attr:`TABLE`, either of the whole table or of the range for
+        `content_id`.
+
+        '''
+        labels = ifilter(self._filter_keys(content_id, subtopic_id), rows)
         labels = imap(lambda p: self._label_from_kvlayer(*p), labels)
         if not include_deleted:
             labels = Label.most_recent(labels)
         return labels
 
+    def cluster_of(self, content_id):
+        '''Find the cluster a content ID is in.
+
+        This requires the store to have been created with
+        `cluster_index` enabled.  Clusters are positive connected
+        components of content IDs, as :meth:`connected_component`
+        would find for `content_id` without a subtopic, and are
+        identified by one of their members.  A content ID with no
+        positive labels is its own cluster.
+
+        The index is only ever extended by :meth:`put`.  If a
+        positive label is later superseded by a negative or unknown
+        one, the index will still include its edge until
+        :meth:`rebuild_cluster_index` is run.
+
+        :param str content_id: content id
+        :return: cluster identifier
+        :rtype: str
+
+        '''
+        self._check_cluster_index()
+        for _, root in self.kvl.get(self.CLUSTER_TABLE, (content_id,)):
+            if root is not None:
+                return root
+        return content_id
+
+    def members(self, cluster_id):
+        '''Get the content IDs in a cluster.
+
+        `cluster_id` must be a cluster identifier returned by
+        :meth:`cluster_of`.  The result is sorted.
+
+        :param str cluster_id: cluster identifier
+        :rtype: list of str
+
+        '''
+        self._check_cluster_index()
+        members = list(k[1] for k in self.kvl.scan_keys(
+            self.CLUSTER_MEMBERS_TABLE, ((cluster_id,), (cluster_id,))))
+        return members or [cluster_id]
+
+    def rebuild_cluster_index(self, batch_size=1000):
+        '''Rebuild the cluster index from scratch.
+
+        This reads every most recent label in the store, so labels
+        that have been superseded no longer join clusters.
+
+        :param int batch_size: number of index rows per write
+        :return: number of clusters with more than one member
+
+        '''
+        self._check_cluster_index()
+        uf = _UnionFind()
+        for label in self.everything():
+            if label.value == CorefValue.Positive:
+                uf.union(label.content_id1, label.content_id2)
+
+        self.kvl.clear_table(self.CLUSTER_TABLE)
+        self.kvl.clear_table(self.CLUSTER_MEMBERS_TABLE)
+        roots = set()
+        rows, members = [], []
+        for content_id, root in uf.items():
+            if content_id == root and uf.size(root) == 1:
+                continue
+            roots.add(root)
+            rows.append(((content_id,), root))
+            members.append(((root, content_id), ''))
+            if len(rows) >= batch_size:
+                self.kvl.put(self.CLUSTER_TABLE, *rows)
+                self.kvl.put(self.CLUSTER_MEMBERS_TABLE, *members)
+                rows, members = [], []
+        if rows:
+            self.kvl.put(self.CLUSTER_TABLE, *rows)
+            self.kvl.put(self.CLUSTER_MEMBERS_TABLE, *members)
+        return len(roots)
+
+    def _check_cluster_index(self):
+        if not self.cluster_index:
+            raise RuntimeError('LabelStore was created without cluster_index')
+
+    def _cluster_update(self, labels):
+        '''Merge the clusters joined by the positive `labels`.
+
+        The clusters of every content ID in `labels` are read with
+        one :mod:`kvlayer` get, and the members of every cluster that
+        is merged with one scan.  The merges are worked out in
+        memory, and the changed index rows are written with one put
+        and one delete per table.  Each merged cluster keeps the
+        identifier of its largest part, so each content ID moves at
+        most a logarithmic number of times.
+
+        This reads and then rewrites the index, so it assumes that
+        only one process writes labels at a time.
+
+        '''
+        pairs = [(label.content_id1, label.content_id2) for label in labels
+                 if label.value == CorefValue.Positive
+                 and label.content_id1 != label.content_id2]
+        if not pairs:
+            return
+        content_ids = sorted(set(cid for pair in pairs for cid in pair))
+        roots = dict((cid, cid) for cid in content_ids)
+        for (cid,), root in self.kvl.get(self.CLUSTER_TABLE,
+                                         *[(cid,) for cid in content_ids]):
+            if root is not None:
+                roots[cid] = root
+        uf = _UnionFind()
+        for cid1, cid2 in pairs:
+            uf.union(roots[cid1], roots[cid2])
+        merged = {}
+        for root, group in uf.items():
+            merged.setdefault(group, []).append(root)
+        merged = [parts for parts in merged.itervalues() if len(parts) > 1]
+        if not merged:
+            return
+
+        old_roots = sorted(root for parts in merged for root in parts)
+        members = dict((root, []) for root in old_roots)
+        for key in self._scan_ranges(
+                self.CLUSTER_MEMBERS_TABLE,
+                [((root,), (root,)) for root in old_roots], keys_only=True):
+            members[key[0]].append(key[1])
+        for root in old_roots:
+            # a singleton cluster has no index rows yet
+            members[root] = members[root] or [root]
+
+        rows, member_rows, deletes = [], [], []
+        for parts in merged:
+            parts.sort(key=lambda root: (-len(members[root]), root))
+            new_root = parts[0]
+            if len(members[new_root]) == 1:
+                rows.append(((new_root,), new_root))
+                member_rows.append(((new_root, new_root), ''))
+            for root in parts[1:]:
+                for member in members[root]:
+                    rows.append(((member,), new_root))
+                    member_rows.append(((new_root, member), ''))
+                    if len(members[root]) > 1:
+                        deletes.append((root, member))
+        self.kvl.put(self.CLUSTER_TABLE, *rows)
+        self.kvl.put(self.CLUSTER_MEMBERS_TABLE, *member_rows)
+        if deletes:
+            self.kvl.delete(self.CLUSTER_MEMBERS_TABLE, *deletes)
+
+    def by_annotator(self, annotator_id, since=None):
+        '''Return a generator of the labels made by an annotator.
+
+        This requires the store to have been created with
+        `annotator_index` enabled, and reads only that annotator's
+        rows.  Only labels that have not been superseded are
+        returned, oldest first.  If `since` is not :const:`None`,
+        only labels with :attr:`Label.epoch_ticks` of at least
+        `since` are returned.
+
+        (Note that even though this returns a generator, it will still
+        consume memory proportional to the number of labels returned.)
+
+        :param str annotator_id: annotator id
+        :param since: earliest epoch ticks to return
+        :rtype: generator of :class:`Label`
+        '''
+        if not self.annotator_index:
+            raise RuntimeError('LabelStore was created without '
+                               'annotator_index')
+        if since is None:
+            start = (annotator_id,)
+        else:
+            start = (annotator_id, long(since))
+        rows = list(self.kvl.scan(self.ANNOTATOR_TABLE,
+                                  (start, (annotator_id,))))
+        # A label is superseded only by a later label from the same
+        # annotator, which is also in `rows`
+        current = []
+        seen = set()
+        for k, v in reversed(rows):
+            if k[2:] not in seen:
+                seen.add(k[2:])
+                current.append((k, v))
+        return (self._label_from_kvlayer(self._key_from_annotator_key(k), v)
+                for k, v in reversed(current))
+
+    def labels_since(self, ticks, cursor=None, limit=None):
+        '''Get the labels written at or after a time.
+
+        This requires the store to have been created with
+        `change_log` enabled.  Every revision of every label with
+        :attr:`Label.epoch_ticks` of at least `ticks` is returned,
+        in time order, including labels that have since been
+        superseded.  At most `limit` labels are returned, if it is
+        not :const:`None`.
+
+        The return value also includes a cursor.  Passing it back as
+        `cursor` resumes strictly after the last label returned, and
+        `ticks` is ignored.  Labels with the same time are logged in
+        the order they were written, so a label written later with
+        the same time as the last one returned is still seen, as
+        long as the clocks of the writing processes agree.  Labels
+        written later with an older time are not seen.  The cursor
+        is a tuple of integers and strings, and may be stored as
+        JSON between calls.
+
+        :param ticks: earliest epoch ticks to return
+        :param cursor: cursor from a previous call
+        :param int limit: maximum number of labels to return
+        :return: pair of list of :class:`Label` and the new cursor
+
+        '''
+        if not self.change_log:
+            raise RuntimeError('LabelStore was created without change_log')
+        if cursor is None:
+            cursor = (long(ticks),)
+        else:
+            cursor = self._parse_log_cursor(cursor)
+        labels = []
+        if limit is None or limit >= 1:
+            for k, v in self.kvl.scan(self.LOG_TABLE, (cursor, ())):
+                if k == cursor:
+                    continue
+                labels.append(self._label_from_kvlayer(
+                    self._key_from_log_key(k), v))
+                cursor = k
+                if limit is not None and len(labels) >= limit:
+                    break
+        return labels, cursor
+
+    @staticmethod
+    def _parse_log_cursor(cursor):
+        '''Undo a round trip of a :meth:`labels_since` cursor through JSON.'''
+        return tuple(long(part) if i < 2 else part.encode('utf-8')
+                     if isinstance(part, unicode) else part
+                     for i, part in enumerate(cursor))
+
+    def compact(self, keep_history=1, older_than=None, dry_run=False,
+                batch_size=1000):
+        '''Delete superseded revisions of labels.
+
+        For every label subject (see :meth:`Label.same_subject_as`),
+        the most recent `keep_history` revisions are kept.  Older
+        revisions are deleted from the label table, under both key
+        orders in the dual layout, and from the subtopic and annotator
+        indexes.  If `older_than` is not :const:`None`, only revisions
+        with :attr:`Label.epoch_ticks` less than it are deleted.  The
+        change log is left alone, since it is a record of writes.
+
+        The table is read in a single pass, with deletes sent every
+        `batch_size` revisions; after each batch the scan resumes
+        where it left off.  If `dry_run` is :const:`True`, nothing is
+        deleted, but the same counts are returned.
+
+        This does not change the results of any query that excludes
+        deleted labels.  The cluster index is not affected.
+
+        :param int keep_history: number of revisions to keep
+        :param older_than: only delete revisions older than this
+        :param bool dry_run: only count what would be deleted
+        :param int batch_size: number of revisions per delete
+        :return: dictionary with the number of ``labels`` (revisions)
+          and kvlayer ``rows`` deleted, and the approximate ``bytes``
+          of keys and values in those rows
+
+        '''
+        if keep_history < 1:
+            raise ValueError('keep_history must be positive, not {0!r}'
+                             .format(keep_history))
+        if batch_size < 1:
+            raise ValueError('batch_size must be positive, not {0!r}'
+                             .format(batch_size))
+        stats = {'labels': 0, 'rows': 0, 'bytes': 0}
+        natural = self._filter_keys()
+        start = ()
+        resume_after = None
+        while True:
+            pending = []
+            finished = True
+            rows = ifilter(natural, self.kvl.scan(self.TABLE, (start, ())))
+            for prefix, group in groupby(rows, lambda p: p[0][:5]):
+                if prefix == resume_after:
+                    continue
+                for i, (k, v) in enumerate(group):
+                    if i < keep_history:
+                        continue
+                    if older_than is None or \
+                       time_complement(k[5]) < older_than:
+                        pending.append((k, v))
+                if len(pending) >= batch_size:
+                    self._delete_revisions(pending, stats, dry_run)
+                    pending = []
+                    if not dry_run:
+                        # Some of the rows we just deleted are further
+                        # along in this scan, so start a new one
+                        start = resume_after = prefix
+                        finished = False
+                        break
+            if finished:
+                break
+        self._delete_revisions(pending, stats, dry_run)
+        return stats
+
+    def _delete_revisions(self, revisions, stats, dry_run):
+        '''Delete label revisions and their index rows.
+
+        `revisions` are ``(key, value)`` rows of :attr:`TABLE` in
+        natural order.  `stats` is updated with the number of
+        labels, rows and bytes deleted.
+
+        '''
+        keys = {}
+        for k1, v in revisions:
+            stats['labels'] += 1
+            for table, (k, _) in self._rows_from_key(k1, v):
+                if table in (self.LOG_TABLE, self.REVERSE_TABLE):
+                    continue
+                table_keys = keys.setdefault(table, set())
+                if k not in table_keys:
+                    table_keys.add(k)
+                    stats['rows'] += 1
+                    stats['bytes'] += len(v) + sum(
+                        len(part) if isinstance(part, str) else 8
+                        for part in k)
+        if not dry_run:
+            for table, table_keys in keys.iteritems():
+                self.kvl.delete(table, *table_keys)
+
+    def rebuild_change_log(self, batch_size=1000):
+        '''Rebuild the change log from scratch.
+
+        This is needed to enable `change_log` on a store that
+        already has labels.
+
+        :param int batch_size: number of log rows per write
+        :return: number of log rows written
+
+        '''
+        if not self.change_log:
+            raise RuntimeError('LabelStore was created without change_log')
+        return self._rebuild_index(self.LOG_TABLE, batch_size)
+
+    def rebuild_subtopic_index(self, batch_size=1000):
+        '''Rebuild the subtopic index from scratch.
+
+        This is needed to enable `subtopic_index` on a store that
+        already has labels.
+
+        :param int batch_size: number of index rows per write
+        :return: number of index rows written
+
+        '''
+        if not self.subtopic_index:
+            raise RuntimeError('LabelStore was created without '
+                               'subtopic_index')
+        return self._rebuild_index(self.SUBTOPIC_TABLE, batch_size)
+
+    def rebuild_annotator_index(self, batch_size=1000):
+        '''Rebuild the annotator index from scratch.
+
+        This is needed to enable `annotator_index` on a store that
+        already has labels.
+
+        :param int batch_size: number of index rows per write
+        :return: number of index rows written
+
+        '''
+        if not self.annotator_index:
+            raise RuntimeError('LabelStore was created without '
+                               'annotator_index')
+        return self._rebuild_index(self.ANNOTATOR_TABLE, batch_size)
+
+    def _rebuild_index(self, table, batch_size):
+        '''Rewrite `table` from every revision of every label.'''
+        self.kvl.clear_table(table)
+        count = 0
+        rows = []
+        for label in self.everything(include_deleted=True):
+            rows.extend(row for row_table, row in self._rows_from_label(label)
+                        if row_table == table)
+            if len(rows) >= batch_size:
+                self.kvl.put(table, *rows)
+                count += len(rows)
+                rows = []
+        if rows:
+            self.kvl.put(table, *rows)
+            count += len(rows)
+        return count
+
+    def migrate_layout(self, batch_size=1000):
+        '''Convert a store from the dual layout to the single layout.
+
+        This store must have been created with `layout` set to
+        ``'single'``.  The migration runs in two passes over the
+        label table.  The first writes the reverse index for every
+        existing label.  The second deletes the second copy of every
+        label that the dual layout wrote.
+
+        Stores with the single layout also read the second copies
+        while they exist, so labels can be read and written through
+        them throughout the migration.  Every process that writes
+        labels must be using the single layout before this starts,
+        though, and every process that reads them before the second
+        pass starts.
+
+        :param int batch_size: number of rows per write or delete
+        :return: dictionary with the number of ``reverse`` index
+          rows written and swapped label ``rows`` deleted
+
+        '''
+        if self.layout != 'single':
+            raise RuntimeError('LabelStore was created without '
+                               'layout="single"')
+        if batch_size < 1:
+            raise ValueError('batch_size must be positive, not {0!r}'
+                             .format(batch_size))
+        stats = {'reverse': 0, 'rows': 0}
+        natural = self._filter_keys()
+
+        reverse = []
+        prev = None
+        for k in self.kvl.scan_keys(self.TABLE):
+            pair = (k[1], k[0])
+            if pair == prev or k[0] == k[1] or not natural((k, None)):
+                continue
+            prev = pair
+            reverse.append((pair, ''))
+            if len(reverse) >= batch_size:
+                self.kvl.put(self.REVERSE_TABLE, *reverse)
+                stats['reverse'] += len(reverse)
+                reverse = []
+        if reverse:
+            self.kvl.put(self.REVERSE_TABLE, *reverse)
+            stats['reverse'] += len(reverse)
+
+        start = ()
+        while True:
+            swapped = []
+            for k in self.kvl.scan_keys(self.TABLE, (start, ())):
+                if not natural((k, None)):
+                    swapped.append(k)
+                    if len(swapped) >= batch_size:
+                        break
+            if swapped:
+                self.kvl.delete(self.TABLE, *swapped)
+                stats['rows'] += len(swapped)
+            if len(swapped) < batch_size:
+                break
+            # Start a new scan after the rows just deleted
+            start = swapped[-1]
+        return stats
+
     def delete_all(self):
-        '''Deletes all labels in the store.'''
-        self.kvl.clear_table(self.TABLE)
+        '''Deletes all labels in the store.
+
+        Every table a label store can use is cleared, whichever
+        indexes and layout this store was created with, so that no
+        index written by another store is left behind.
+
+        '''
+        for namespace in (self._kvlayer_namespace, self._reverse_namespace,
+                          self._subtopic_namespace, self._annotator_namespace,
+                          self._log_namespace, self._cluster_namespace):
+            self.kvl.setup_namespace(namespace)
+            for table in namespace:
+                self.kvl.clear_table(table)
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _cache_get(self, key):
+        if self.cache is None:
+            return None
+        return self.cache.get(key)
+
+    def _cache_put(self, key, labels, content_ids):
+        if self.cache is not None:
+            self.cache.put(key, labels, content_ids)
+
+
+_sequence_lock = threading.Lock()
+_last_sequence = [0]
+
+
+def _write_sequence():
+    '''Get a number larger than any this process has got before.
+
+    This is the current time in microseconds, or one more than the
+    last number if that is not larger, so numbers from processes with
+    agreeing clocks are in the order they were taken.
+
+    '''
+    with _sequence_lock:
+        _last_sequence[0] = max(_last_sequence[0] + 1,
+                                long(time.time() * 1000000))
+        return _last_sequence[0]
+
+
+def _scan(kvl, table, ranges, keys_only):
+    '''Scan `ranges` of `table` with one :mod:`kvlayer` call.'''
+    if keys_only:
+        return kvl.scan_keys(table, *ranges)
+    return kvl.scan(table, *ranges)
+
+
+def _concurrent_scans(clients, table, ranges, keys_only):
+    '''Scan parts of `ranges` at the same time, one client per thread.
+
+    `ranges` is split into at most one contiguous part per client.
+    Returns a list of the rows of each part, in order.  If any scan
+    fails, its exception is raised once every thread has finished.
+
+    '''
+    num_parts = min(len(clients), len(ranges))
+    bounds = [len(ranges) * i // num_parts for i in xrange(num_parts + 1)]
+    results = [None] * num_parts
+    errors = []
+
+    def run(i):
+        try:
+            results[i] = list(_scan(clients[i], table,
+                                    ranges[bounds[i]:bounds[i + 1]],
+                                    keys_only))
+        except Exception:
+            errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in xrange(num_parts)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        exc_type, exc_value, tb = errors[0]
+        raise exc_type, exc_value, tb
+    return results
+
+
+def _natural_row(row):
+    '''Check whether a :attr:`LabelStore.TABLE` row is in natural order.
+
+    This is true of exactly one of the two rows the dual layout
+    writes for each label, and of every row the single layout writes.
+
+    '''
+    k = row[0]
+    return k[0] < k[1] or (k[0] == k[1] and k[2] <= k[3])
+
+
+def _most_recent_rows(rows):
+    '''Filter :attr:`LabelStore.TABLE` rows to the most recent labels.
+
+    This does the same thing as :meth:`Label.most_recent`, without
+    making labels.  `rows` must be in key order and all in natural
+    order; then all the revisions of a label are adjacent, newest
+    first, and share the first five parts of their keys.
+
+    '''
+    prev_prefix = None
+    for row in rows:
+        prefix = row[0][:5]
+        if prefix != prev_prefix:
+            prev_prefix = prefix
+            yield row
+
+
+class Clique(object):
+    '''A compact representation of an expanded connected component.
+
+    Every ident in a positive connected component is coreferent with
+    every other.  Rather than holding a :class:`Label` for each of
+    those pairs, as :meth:`LabelStore.expand` returns, this holds
+    the idents in the component and the data-backed labels, and
+    creates pairs and inferred labels only on demand.
+
+    Idents are given and returned in the same form as the `ident`
+    passed to :meth:`LabelStore.clique`: content IDs for a content
+    component, or ``(content_id, subtopic_id)`` pairs for a subtopic
+    component.
+
+    .. attribute:: labels
+
+       List of the data-backed :class:`Label` objects.
+
+    .. attribute:: subtopic
+
+       :const:`True` if this is a subtopic connected component.
+
+    .. automethod:: __init__
+    .. automethod:: __contains__
+    .. automethod:: __iter__
+    .. automethod:: __len__
+    .. automethod:: coreferent
+    .. automethod:: pairs
+    .. automethod:: pair_count
+    .. automethod:: inferred_labels
+    .. automethod:: expanded_labels
+    .. automethod:: expanded_count
+
+    '''
+    def __init__(self, labels, subtopic=False, idents=()):
+        '''Create a clique from the labels of a connected component.
+
+        :param labels: iterable of positive :class:`Label` for the
+          connected component
+        :param bool subtopic: whether this is a subtopic component
+        :param idents: additional idents in the component, such as
+          one with no labels at all
+        '''
+        self.labels = list(labels)
+        self.subtopic = subtopic
+        self._idents, self._data_backed = component_idents(
+            self.labels, subtopic=subtopic)
+        self._idents.update(normalize_ident(ident) for ident in idents)
+
+    def _ident(self, ident):
+        ident = normalize_ident(ident)
+        if not self.subtopic:
+            ident = (ident[0], None)
+        return ident
+
+    def __contains__(self, ident):
+        '''Test if an ident is in the component.'''
+        return self._ident(ident) in self._idents
+
+    def __iter__(self):
+        '''Iterate over the idents in the component, in sorted order.'''
+        for ident in sorted(self._idents):
+            yield ident if self.subtopic else ident[0]
+
+    def __len__(self):
+        '''Get the number of idents in the component.'''
+        return len(self._idents)
+
+    def coreferent(self, ident1, ident2):
+        '''Test if two idents are both in the component.'''
+        return ident1 in self and ident2 in self
+
+    def pairs(self):
+        '''Return a generator of every pair of distinct idents.
+
+        Each unordered pair is yielded once, whether or not it is
+        data-backed.
+
+        '''
+        return combinations(iter(self), 2)
+
+    def pair_count(self):
+        '''Get the number of pairs :meth:`pairs` would yield.'''
+        n = len(self._idents)
+        return n * (n - 1) // 2
+
+    def inferred_labels(self):
+        '''Return a generator of labels for the pairs with no label.
+
+        These are the labels :func:`expand_labels` returns.  Their
+        annotator is an arbitrary one from :attr:`labels`.
+
+        '''
+        if not self.labels:
+            return
+        annotator = self.labels[0].annotator_id
+        # We do not want to rebuild the Labels we already have,
+        # because they have true annotator_id and subtopic
+        # fields that we may want to preserve.
+        for ident1, ident2 in combinations(sorted(self._idents), 2):
+            if (ident1, ident2) not in self._data_backed:
+                (cid1, subid1), (cid2, subid2) = ident1, ident2
+                yield Label(cid1, cid2, annotator, CorefValue.Positive,
+                            subtopic_id1=subid1, subtopic_id2=subid2)
+
+    def expanded_labels(self):
+        '''Return a generator of the labels :meth:`LabelStore.expand`
+        returns: the data-backed labels, then the inferred labels.'''
+        for label in self.labels:
+            yield label
+        for label in self.inferred_labels():
+            yield label
+
+    def expanded_count(self):
+        '''Get the number of labels :meth:`expanded_labels` yields.'''
+        if not self.labels:
+            return 0
+        return len(self.labels) + self.pair_count() - len(self._data_backed)
+
+
+class _UnionFind(object):
+    '''In-memory disjoint sets with path compression and union by size.'''
+
+    def __init__(self):
+        self._parent = {}
+        self._size = {}
+
+    def find(self, x):
+        parent = self._parent.get(x)
+        if parent is None:
+            return x
+        root = x
+        while parent != root:
+            root = parent
+            parent = self._parent[root]
+        while x != root:
+            x, self._parent[x] = self._parent[x], root
+        return root
+
+    def union(self, x, y):
+        for z in (x, y):
+            if z not in self._parent:
+                self._parent[z] = z
+                self._size[z] = 1
+        x, y = self.find(x), self.find(y)
+        if x == y:
+            return x
+        if self._size[x] < self._size[y]:
+            x, y = y, x
+        self._parent[y] = x
+        self._size[x] += self._size.pop(y)
+        return x
+
+    def size(self, x):
+        return self._size.get(self.find(x), 1)
+
+    def items(self):
+        '''Yield ``(element, root)`` for every element seen.'''
+        for x in self._parent.keys():
+            yield x, self.find(x)
 
 
 def unordered_pair_eq(pair1, pair2):
@@ -736,24 +2297,31 @@ def expand_labels(labels, subtopic=False):
     if len(labels) == 0:
         return
 
-    annotator = labels[0].annotator_id
+    for label in Clique(labels, subtopic=subtopic).inferred_labels():
+        yield label
+
+
+def component_idents(labels, subtopic=False):
+    '''Collect the idents and labeled pairs of a connected component.
 
+    ``labels`` are the labels of a connected component, as for
+    :func:`expand_labels`.  Returns a pair of the set of idents in
+    the component and the set of normalized pairs of distinct idents
+    that have a label between them.  The idents are as returned by
+    :func:`idents_from_label`.
+
+    :param labels: iterable of :class:`Label` for the connected component.
+    :rtype: (``set`` of ident, ``set`` of (ident, ident))
+    '''
     data_backed = set()
     connected_component = set()
     for label in labels:
         ident1, ident2 = idents_from_label(label, subtopic=subtopic)
-        data_backed.add(normalize_pair(ident1, ident2))
+        if ident1 != ident2:
+            data_backed.add(normalize_pair(ident1, ident2))
         connected_component.add(ident1)
         connected_component.add(ident2)
-
-    # We do not want to rebuild the Labels we already have,
-    # because they have true annotator_id and subtopic
-    # fields that we may want to preserve.
-    for ident1, ident2 in combinations(connected_component, 2):
-        if normalize_pair(ident1, ident2) not in data_backed:
-            (cid1, subid1), (cid2, subid2) = ident1, ident2
-            yield Label(cid1, cid2, annotator, CorefValue.Positive,
-                        subtopic_id1=subid1, subtopic_id2=subid2)
+    return connected_component, data_backed
 
 
 def expand_labels_with_subtopics(labels):
@@ -14,7 +14,10 @@ from __future__ import absolute_import, division, print_function
 import argparse
 from itertools import groupby, imap, islice
 import json
+import Queue
 import sys
+import threading
+import time
 
 import kvlayer
 import yakonfig
@@ -23,7 +26,9 @@ from dossier.label import CorefValue, Label, LabelStore
 
 
 def label_to_dict(lab):
-    return {field: getattr(lab, field) for field in lab._fields}
+    d = {field: getattr(lab, field) for field in lab._fields}
+    d['value'] = lab.value.value
+    return d
 
 
 def dict_to_label(d):
@@ -32,25 +37,218 @@ def dict_to_label(d):
             return v.encode('utf-8')
         return v
 
-    def to_long(v):
-        if isinstance(v, int):
-            return long(v)
-        return v
+    d = {k: to_bytes(v) for k, v in d.items()}
+    if isinstance(d.get('epoch_ticks'), int):
+        d['epoch_ticks'] = long(d['epoch_ticks'])
+    return Label(**d)
+
+
+def json_lines(fin):
+    '''Generate the non-blank lines of a JSON-lines file.'''
+    for line in fin:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def positive_int(s):
+    '''Parse a command line argument that must be at least 1.'''
+    n = int(s)
+    if n < 1:
+        raise argparse.ArgumentTypeError('must be positive, not %d' % n)
+    return n
+
+
+class Progress(object):
+    '''Periodically report the number of labels processed.
+
+    If `failed` is not :const:`None`, reports also include it.
+
+    '''
+    def __init__(self, stream, verb, every=10000, failed=None):
+        self.stream = stream
+        self.verb = verb
+        self.every = every
+        self.count = 0
+        self.failed = failed
+        self.start = time.time()
+
+    def add(self, n=1):
+        before = self.count // self.every
+        self.count += n
+        if self.count // self.every != before:
+            self.report()
+
+    def report(self):
+        elapsed = time.time() - self.start
+        rate = self.count / elapsed if elapsed > 0 else 0
+        msg = '%s %d labels in %.1fs (%.0f labels/s)' % (
+            self.verb, self.count, elapsed, rate)
+        if self.failed is not None:
+            msg += ', %d failed' % self.failed
+        self.stream.write(msg + '\n')
+
+
+class LabelLoader(object):
+    '''Write labels to one or more label stores.
+
+    With more than one label store, each is written by its own
+    thread.  Batches of labels are handed to the threads in turn
+    through queues of at most `queue_size` batches, so reading the
+    input never gets far ahead of the writers.  If a batch cannot be
+    written, its labels are written again one at a time.  Rows that
+    cannot be parsed, and labels that cannot be written, are reported
+    on `errors` and counted as failed.
+
+    '''
+    def __init__(self, label_stores, progress, errors, batch_size=1000,
+                 queue_size=4):
+        self.label_stores = label_stores
+        self.progress = progress
+        self.errors = errors
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+
+    def load(self, rows):
+        '''Write labels from `rows` of JSON strings or dictionaries.'''
+        self.progress.failed = 0
+        batches = self._batches(rows)
+        if len(self.label_stores) == 1:
+            for batch in batches:
+                self._write(self.label_stores[0], batch)
+            return
+        queues, threads = [], []
+        for label_store in self.label_stores:
+            queue = Queue.Queue(maxsize=self.queue_size)
+            thread = threading.Thread(target=self._worker,
+                                      args=(label_store, queue))
+            thread.daemon = True
+            thread.start()
+            queues.append(queue)
+            threads.append(thread)
+        for i, batch in enumerate(batches):
+            queues[i % len(queues)].put(batch)
+        for queue in queues:
+            queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _batches(self, rows):
+        batch = []
+        for i, row in enumerate(rows):
+            try:
+                if isinstance(row, basestring):
+                    row = json.loads(row)
+                batch.append(dict_to_label(row))
+            except (TypeError, ValueError, AttributeError) as exc:
+                self._failed(1, 'row %d: %s' % (i + 1, exc))
+                continue
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _worker(self, label_store, queue):
+        while True:
+            batch = queue.get()
+            if batch is None:
+                break
+            self._write(label_store, batch)
+
+    def _write(self, label_store, batch):
+        try:
+            label_store.put_many(batch, batch_size=len(batch))
+        except Exception:
+            # Find the labels that failed by writing them one at a time
+            written = 0
+            for label in batch:
+                try:
+                    label_store.put(label)
+                except Exception as exc:
+                    self._failed(1, 'label %s: %s' % (label, exc))
+                else:
+                    written += 1
+        else:
+            written = len(batch)
+        with self.lock:
+            self.progress.add(written)
+
+    def _failed(self, n, msg):
+        with self.lock:
+            self.progress.failed += n
+            self.errors.write('failed %s\n' % msg)
 
-    return Label(**{k: to_long(to_bytes(v)) for k, v in d.items()})
+
+class LabelStoreConfig(yakonfig.Configurable):
+    '''Configuration of the label stores the tool opens.
+
+    The ``dossier.label`` configuration block, or the matching
+    command-line options, select the indexes and layout of
+    :class:`~dossier.label.LabelStore`.  They must match the options
+    of every other process writing to the same store.
+
+    '''
+    config_name = LabelStore.config_name
+    default_config = {
+        'cluster_index': False,
+        'subtopic_index': False,
+        'annotator_index': False,
+        'change_log': False,
+        'layout': 'dual',
+    }
+    runtime_keys = {key: key for key in default_config}
+
+    def add_arguments(self, p):
+        for key in ('cluster_index', 'subtopic_index', 'annotator_index',
+                    'change_log'):
+            p.add_argument('--' + key.replace('_', '-'), action='store_const',
+                           const=True, default=None,
+                           help='Maintain the label store\'s %s.'
+                                % key.replace('_', ' '))
+        p.add_argument('--layout', choices=['dual', 'single'], default=None,
+                       help='Row layout of the label store.')
+
+    def check_config(self, config, name):
+        if config.get('layout') not in ('dual', 'single'):
+            raise yakonfig.ConfigurationError(
+                '{0}.layout must be "dual" or "single", not {1!r}'
+                .format(name, config.get('layout')))
+
+
+def label_store_options():
+    '''Get the :class:`~dossier.label.LabelStore` options configured.
+
+    :return: keyword arguments for :class:`~dossier.label.LabelStore`
+    :rtype: dict
+
+    '''
+    try:
+        config = yakonfig.get_global_config(LabelStore.config_name)
+    except KeyError:
+        config = {}
+    options = dict(LabelStoreConfig.default_config)
+    options.update((key, config[key]) for key in options if key in config)
+    return options
 
 
 class App(yakonfig.cmd.ArgParseCmd):
     def __init__(self, *args, **kwargs):
         yakonfig.cmd.ArgParseCmd.__init__(self, *args, **kwargs)
         self._label_store = None
+        self.stderr = sys.stderr
 
     @property
     def label_store(self):
         if self._label_store is None:
-            self._label_store = LabelStore(kvlayer.client())
+            self._label_store = self.new_label_store()
         return self._label_store
 
+    def new_label_store(self):
+        '''Make a label store with its own kvlayer client.'''
+        return LabelStore(kvlayer.client(), **label_store_options())
+
     def args_list(self, p):
         p.add_argument('--include-deleted', action='store_true',
                        help='When set, show deleted labels.')
@@ -67,21 +265,53 @@ class App(yakonfig.cmd.ArgParseCmd):
         p.add_argument('--exclude-deleted', action='store_true',
                        help='When set, only the most recent labels are '
                             'dumped.')
+        p.add_argument('--format', choices=['json', 'jsonl'], default='json',
+                       help='Write a single JSON list, or one JSON object '
+                            'per line. jsonl uses constant memory.')
 
     def do_dump_all(self, args):
-        labels = list(imap(label_to_dict, self.label_store.everything(
-            include_deleted=not args.exclude_deleted)))
-        json.dump(labels, fp=sys.stdout)
+        labels = imap(label_to_dict, self.label_store.everything(
+            include_deleted=not args.exclude_deleted))
+        if args.format == 'json':
+            json.dump(list(labels), fp=self.stdout)
+            return
+        progress = Progress(self.stderr, 'dumped')
+        for d in labels:
+            self.stdout.write(json.dumps(d, sort_keys=True))
+            self.stdout.write('\n')
+            progress.add()
+        progress.report()
 
     def args_load(self, p):
         p.add_argument('fpath', nargs='?', default=None,
                        help='File path containing label data. When absent, '
                             'stdin is used.')
+        p.add_argument('--format', choices=['json', 'jsonl'], default='json',
+                       help='Read a single JSON list, or one JSON object '
+                            'per line. jsonl uses constant memory.')
+        p.add_argument('--batch-size', type=positive_int, default=1000,
+                       help='Number of labels to write at a time.')
+        p.add_argument('--workers', type=positive_int, default=1,
+                       help='Number of threads writing labels, each with '
+                            'its own database connection.')
 
     def do_load(self, args):
-        fout = sys.stdin if args.fpath is None else open(args.fpath, 'w+')
-        for lab in imap(dict_to_label, json.load(fp=fout)):
-            self.label_store.put(lab)
+        label_stores = [self.label_store] + [
+            self.new_label_store() for _ in xrange(args.workers - 1)]
+        fin = sys.stdin if args.fpath is None else open(args.fpath, 'r')
+        try:
+            if args.format == 'json':
+                rows = json.load(fp=fin)
+            else:
+                rows = json_lines(fin)
+            progress = Progress(self.stderr, 'loaded')
+            loader = LabelLoader(label_stores, progress, self.stderr,
+                                 batch_size=args.batch_size)
+            loader.load(rows)
+            progress.report()
+        finally:
+            if fin is not sys.stdin:
+                fin.close()
 
     def args_get(self, p):
         p.add_argument('content_id', type=str,
@@ -107,6 +337,55 @@ class App(yakonfig.cmd.ArgParseCmd):
         for label in connected:
             print(label)
 
+    def args_conflicts(self, p):
+        p.add_argument('--subtopic', action='store_true',
+                       help='Compare subtopics rather than content ids.')
+
+    def do_conflicts(self, args):
+        for label in self.label_store.find_conflicts(subtopic=args.subtopic):
+            self.stdout.write(json.dumps(label_to_dict(label),
+                                         sort_keys=True))
+            self.stdout.write('\n')
+
+    def args_compact(self, p):
+        p.add_argument('--keep-history', type=positive_int, default=1,
+                       help='Number of revisions of each label to keep.')
+        p.add_argument('--older-than', type=int, default=None,
+                       help='Only delete revisions older than this many '
+                            'seconds since the epoch.')
+        p.add_argument('--dry-run', action='store_true',
+                       help='Only report what would be deleted.')
+
+    def do_compact(self, args):
+        stats = self.label_store.compact(keep_history=args.keep_history,
+                                         older_than=args.older_than,
+                                         dry_run=args.dry_run)
+        self.stdout.write('%s %d labels (%d rows, %d bytes)\n' % (
+            'would delete' if args.dry_run else 'deleted',
+            stats['labels'], stats['rows'], stats['bytes']))
+
+    def args_rebuild_clusters(self, p):
+        pass
+
+    def do_rebuild_clusters(self, args):
+        label_store = LabelStore(self.label_store.kvl,
+                                 **dict(label_store_options(),
+                                        cluster_index=True))
+        clusters = label_store.rebuild_cluster_index()
+        self.stdout.write('%d clusters\n' % clusters)
+
+    def args_migrate_layout(self, p):
+        pass
+
+    def do_migrate_layout(self, args):
+        label_store = LabelStore(self.label_store.kvl,
+                                 **dict(label_store_options(),
+                                        layout='single'))
+        stats = label_store.migrate_layout()
+        self.stdout.write('%d reverse index rows written, '
+                          '%d label rows deleted\n'
+                          % (stats['reverse'], stats['rows']))
+
     def args_delete_all(self, p):
         pass
 
@@ -121,5 +400,5 @@ def main():
         description='Interact with DossierStack truth data.')
     app = App()
     app.add_arguments(p)
-    args = yakonfig.parse_args(p, [kvlayer, yakonfig])
+    args = yakonfig.parse_args(p, [kvlayer, yakonfig, LabelStoreConfig()])
     app.main(args)
@@ -7,7 +7,10 @@ against the fastest, which is just a raw tuple).
 
 The second fastest is a plain namedtuple with nothing going on
 in its constructor. Apparently, we're paying dearly for all the
-case analysis in ``dossier.label.Label.__new__``.
+case analysis in ``dossier.label.Label.__init__``.
+``Label._from_trusted``, which the label store uses for labels it
+reads back, skips that and is about as fast as the plain slots
+class.
 
 This performance comparison may be important some day because label
 filtering is done *after* the construction of label objects, which
@@ -49,6 +52,12 @@ def bench_real_namedtuple():
         RealLabel(cid, cid, ann_id, coref_value, subid, subid, ticks)
 
 
+def bench_real_trusted():
+    for _ in xrange(100):
+        RealLabel._from_trusted(cid, cid, ann_id, coref_value, subid, subid,
+                                ticks, 1)
+
+
 def bench_namedtuple():
     for _ in xrange(100):
         Label(cid, cid, ann_id, coref_value, subid, subid, ticks)
@@ -0,0 +1,302 @@
+'''Benchmarks for the label store.
+
+These measure :class:`dossier.label.LabelStore` operations on a
+synthetic label graph in local memory.  They are not run by the test
+suite.
+
+The graph is a set of positive components, each a random tree of
+content IDs, plus negative labels between components.  Its size,
+the distribution of component sizes, the number of subtopics of each
+content ID and the number of revisions of each label can all be set
+from the command line, and the same ``--seed`` always makes the same
+graph.  The results are written as JSON, so that runs from different
+releases can be compared:
+
+.. code-block:: bash
+
+    python bench_label_store.py --components 500 --sizes zipf \\
+        --output results.json
+
+The local backend sorts a table on every scan, so queries get slower
+with the size of the whole store, not just the size of the answer.
+
+To run the benchmarks, use ``python bench_label_store.py``.
+'''
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import platform
+import random
+import sys
+from timeit import default_timer
+
+from kvlayer._local_memory import LocalStorage
+
+from dossier.label import CorefValue, Label, LabelStore
+from dossier.label.run import positive_int
+
+START_TICKS = 1400000000
+
+
+def make_store(**kwargs):
+    kvl = LocalStorage(app_name='bench', namespace='bench')
+    kvl.delete_namespace()
+    return LabelStore(kvl, **kwargs)
+
+
+def component_sizes(config, rng):
+    '''Draw the size of each component.'''
+    for _ in xrange(config.components):
+        if config.sizes == 'fixed':
+            size = config.size
+        elif config.sizes == 'uniform':
+            size = rng.randint(1, 2 * config.size - 1)
+        else:
+            size = int(config.size * rng.paretovariate(config.zipf_alpha)
+                       * (config.zipf_alpha - 1) / config.zipf_alpha)
+        yield max(1, min(size, config.max_size))
+
+
+def make_graph(config):
+    '''Make the synthetic label graph described by `config`.
+
+    :return: list of the most recent labels, list of every revision
+      in the order they should be written, list of components as
+      lists of content IDs
+
+    '''
+    rng = random.Random(config.seed)
+    subtopics = ['sub%d' % i for i in xrange(config.subtopics)] or ['']
+    annotators = ['annotator%d' % i for i in xrange(config.annotators)]
+
+    def label(cid1, cid2, value):
+        return (cid1, cid2, rng.choice(annotators), value,
+                rng.choice(subtopics), rng.choice(subtopics))
+
+    components = []
+    subjects = []
+    next_id = 0
+    for size in component_sizes(config, rng):
+        members = ['content%d' % i for i in xrange(next_id, next_id + size)]
+        next_id += size
+        components.append(members)
+        for i, cid in enumerate(members[1:], 1):
+            subjects.append(label(rng.choice(members[:i]), cid, 1))
+    for _ in xrange(int(config.negative_ratio * len(components))
+                    if len(components) > 1 else 0):
+        comp1, comp2 = rng.sample(components, 2)
+        subjects.append(label(rng.choice(comp1), rng.choice(comp2), -1))
+
+    current, revisions = [], []
+    ticks = START_TICKS
+    for depth in xrange(config.revisions, 0, -1):
+        for cid1, cid2, annotator, value, sub1, sub2 in subjects:
+            if depth > 1:
+                value = rng.choice([-1, 0, 1])
+            ticks += 1
+            lab = Label(cid1, cid2, annotator, value, sub1, sub2,
+                        epoch_ticks=ticks)
+            revisions.append(lab)
+            if depth == 1:
+                current.append(lab)
+    return current, revisions, components
+
+
+def summarize(seconds):
+    '''Summarize a list of timings, in seconds.'''
+    seconds = sorted(seconds)
+    n = len(seconds)
+    if n == 0:
+        return {'calls': 0}
+    total = sum(seconds)
+    return {
+        'calls': n,
+        'total': total,
+        'mean': total / n,
+        'min': seconds[0],
+        'p50': seconds[n // 2],
+        'p90': seconds[min(n - 1, int(n * 0.9))],
+        'max': seconds[-1],
+        'per_second': n / total if total else None,
+    }
+
+
+def timed(fn, args):
+    '''Call `fn` with each of `args`, and time each call.
+
+    Generators are consumed, so lazy results are counted too.
+
+    :return: list of seconds, number of results
+
+    '''
+    seconds = []
+    results = 0
+    for arg in args:
+        start = default_timer()
+        result = fn(arg)
+        if result is not None and not isinstance(result, Label):
+            results += sum(1 for _ in result)
+        else:
+            results += 1
+        seconds.append(default_timer() - start)
+    return seconds, results
+
+
+def bench_operations(config, graph):
+    '''Time the store's operations on the synthetic graph.'''
+    current, revisions, components = graph
+    rng = random.Random(config.seed + 1)
+    label_store = make_store(layout=config.layout)
+    content_ids = [cid for members in components for cid in members]
+    sample = [rng.choice(content_ids) for _ in xrange(config.queries)]
+    if config.subtopics:
+        idents = [(cid, 'sub%d' % rng.randrange(config.subtopics))
+                  for cid in sample]
+    else:
+        idents = sample
+    negatives = [lab.content_id1 for lab in current
+                 if lab.value == CorefValue.Negative] or sample
+    negative_sample = [rng.choice(negatives) for _ in xrange(config.queries)]
+    labels = [rng.choice(current) for _ in xrange(config.queries)
+              if current]
+
+    results = {}
+    seconds, _ = timed(label_store.put, revisions)
+    results['put'] = summarize(seconds)
+    # The local backend sorts the table again on the first scan after
+    # a write; do that here rather than in the first query.
+    list(label_store.everything())
+
+    def get(lab):
+        return label_store.get(lab.content_id1, lab.content_id2,
+                               lab.annotator_id, lab.subtopic_id1,
+                               lab.subtopic_id2)
+
+    queries = [
+        ('get', get, labels),
+        ('directly_connected', label_store.directly_connected, sample),
+        ('connected_component', label_store.connected_component, sample),
+        ('connected_component_subtopic', label_store.connected_component,
+         idents),
+        ('expand', label_store.expand, sample),
+        ('expand_subtopic', label_store.expand, idents),
+        ('negative_inference', label_store.negative_inference,
+         negative_sample),
+        ('everything', lambda _: label_store.everything(),
+         xrange(config.repeat)),
+        ('everything_include_deleted',
+         lambda _: label_store.everything(include_deleted=True),
+         xrange(config.repeat)),
+    ]
+    for name, fn, args in queries:
+        seconds, count = timed(fn, args)
+        results[name] = summarize(seconds)
+        results[name]['results'] = count
+    return results
+
+
+def bench_intern_ids(config, graph):
+    '''Compare reading every label with and without `intern_ids`.'''
+    _, revisions, _ = graph
+    results = {}
+    for intern_ids in (False, True):
+        label_store = make_store(layout=config.layout, intern_ids=intern_ids)
+        label_store.put_many(revisions)
+        start = default_timer()
+        labels = list(label_store.everything(include_deleted=True))
+        results['intern_ids=%s' % intern_ids] = {
+            'labels': len(labels),
+            'seconds': default_timer() - start,
+            'id_string_bytes': string_bytes(labels),
+        }
+    return results
+
+
+def string_bytes(labels):
+    '''Count the bytes of the distinct ID strings in `labels`.'''
+    seen = {}
+    for label in labels:
+        for s in (label.content_id1, label.content_id2, label.subtopic_id1,
+                  label.subtopic_id2, label.annotator_id):
+            seen[id(s)] = sys.getsizeof(s)
+    return sum(seen.itervalues())
+
+
+BENCHMARKS = dict((name[len('bench_'):], fn)
+                  for name, fn in globals().items()
+                  if name.startswith('bench_'))
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description='Time label store operations on a synthetic graph.')
+    p.add_argument('--components', type=positive_int, default=200,
+                   help='Number of positive components.')
+    p.add_argument('--size', type=int, default=5,
+                   help='Typical number of content IDs in a component.')
+    p.add_argument('--sizes', choices=['fixed', 'uniform', 'zipf'],
+                   default='uniform',
+                   help='Distribution of component sizes: all --size, '
+                        'uniform with mean --size, or a heavy-tailed '
+                        'Pareto distribution with mean --size.')
+    p.add_argument('--zipf-alpha', type=float, default=2.0,
+                   help='Shape of the zipf size distribution; smaller '
+                        'is more skewed.  Must be more than 1.')
+    p.add_argument('--max-size', type=int, default=1000,
+                   help='Largest component size.')
+    p.add_argument('--subtopics', type=int, default=2,
+                   help='Number of subtopics of each content ID; 0 for '
+                        'labels without subtopics.')
+    p.add_argument('--revisions', type=int, default=2,
+                   help='Number of revisions written for each label.')
+    p.add_argument('--negative-ratio', type=float, default=0.5,
+                   help='Negative labels per component.')
+    p.add_argument('--annotators', type=int, default=10,
+                   help='Number of annotators.')
+    p.add_argument('--layout', choices=['dual', 'single'], default='dual',
+                   help='Row layout of the label store.')
+    p.add_argument('--queries', type=int, default=50,
+                   help='Number of calls of each query.')
+    p.add_argument('--repeat', type=int, default=3,
+                   help='Number of calls of everything().')
+    p.add_argument('--seed', type=int, default=0,
+                   help='Random seed for the graph and the queries.')
+    p.add_argument('--bench', action='append', choices=sorted(BENCHMARKS),
+                   help='Benchmark to run; may be repeated.  Default: all.')
+    p.add_argument('--output', default=None,
+                   help='File to write the JSON results to.  Default: '
+                        'stdout.')
+    config = p.parse_args()
+    if config.zipf_alpha <= 1:
+        p.error('--zipf-alpha must be more than 1')
+
+    graph = make_graph(config)
+    current, revisions, components = graph
+    report = {
+        'config': vars(config),
+        'python': platform.python_version(),
+        'graph': {
+            'components': len(components),
+            'content_ids': sum(len(members) for members in components),
+            'largest_component': max(len(members)
+                                     for members in components),
+            'labels': len(current),
+            'revisions': len(revisions),
+        },
+        'results': {},
+    }
+    for name in config.bench or sorted(BENCHMARKS):
+        print('running %s' % name, file=sys.stderr)
+        report['results'][name] = BENCHMARKS[name](config, graph)
+
+    if config.output is None:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(config.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
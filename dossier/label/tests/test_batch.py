@@ -0,0 +1,72 @@
+'''dossier.label.tests
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2012-2015 Diffeo, Inc.
+'''
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+from dossier.label import CorefValue, Label, LabelBatch, LabelStore
+from dossier.label.tests import kvl  # noqa
+
+
+@pytest.yield_fixture  # noqa
+def label_store(kvl):
+    lstore = LabelStore(kvl)
+    yield lstore
+    lstore.delete_all()
+
+
+def make_labels():
+    return [Label('a', 'b', 'x', 1, epoch_ticks=1),
+            Label('a', 'b', 'x', -1, epoch_ticks=2),
+            Label('b', 'c', 'y', 1, '1', '2', epoch_ticks=3),
+            Label('d', 'c', 'x', 0, epoch_ticks=4),
+            Label('e', 'e', 'y', -1, '2', '1', epoch_ticks=5)]
+
+
+def test_batch_round_trip():
+    labels = make_labels()
+    batch = LabelBatch(labels)
+    assert len(batch) == 5
+    assert list(batch) == labels
+    assert batch[3] == labels[3]
+    assert batch.content_id1 == ['a', 'a', 'b', 'c', 'e']
+    assert list(batch.value) == [1, -1, 1, 0, -1]
+
+
+def test_batch_unicode_ids():
+    labels = [Label(u'caf\xe9', u'b', u'x', 1, epoch_ticks=1),
+              Label('a', 'b', 'x', 1, epoch_ticks=2)]
+    batch = LabelBatch(labels)
+    assert list(batch) == labels
+    assert batch.content_id2 == [u'caf\xe9', 'b']
+    assert batch.content_id1[1] is intern('a')
+
+
+def test_batch_filter():
+    labels = make_labels()
+    batch = LabelBatch(labels)
+    assert list(batch.filter(value=CorefValue.Negative)) == \
+        [labels[1], labels[4]]
+    assert list(batch.filter(value=1, annotator_id='x')) == [labels[0]]
+    assert list(batch.filter(since=2, before=5)) == labels[1:4]
+    assert list(batch.filter()) == labels
+    assert len(batch.filter(annotator_id='z')) == 0
+    assert batch.mask(annotator_id='y') == [False, False, True, False, True]
+
+
+def test_everything_batches(label_store):
+    labels = make_labels()
+    label_store.put_many(labels)
+    for include_deleted in (False, True):
+        everything = list(label_store.everything(
+            include_deleted=include_deleted))
+        batches = list(label_store.everything_batches(
+            batch_size=2, include_deleted=include_deleted))
+        assert [len(batch) for batch in batches][:-1] == \
+            [2] * (len(batches) - 1)
+        assert [l for batch in batches for l in batch] == everything
+    with pytest.raises(ValueError):
+        next(label_store.everything_batches(batch_size=0))
@@ -0,0 +1,107 @@
+'''dossier.label.tests
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2012-2015 Diffeo, Inc.
+'''
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+from dossier.label import CorefValue, Label, LabelStore
+from dossier.label.cache import LabelCache
+from dossier.label.tests import kvl  # noqa
+
+
+@pytest.yield_fixture  # noqa
+def label_store(kvl):
+    lstore = LabelStore(kvl, cache=LabelCache(max_entries=100))
+    yield lstore
+    lstore.delete_all()
+
+
+def test_lru_eviction():
+    cache = LabelCache(max_entries=2)
+    cache.put('a', [], ['a'])
+    cache.put('b', [], ['b'])
+    assert cache.get('a') == []
+    cache.put('c', [], ['c'])
+    assert cache.get('b') is None
+    assert cache.get('a') == []
+    assert cache.get('c') == []
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'evictions': 1,
+                             'entries': 2, 'bytes': cache.num_bytes}
+
+
+def test_byte_limit():
+    labels = [Label('a', 'b', '', 1)]
+    cache = LabelCache(max_bytes=1)
+    cache.put('a', labels, ['a'])
+    assert len(cache) == 0
+    assert cache.num_bytes == 0
+    assert cache.evictions == 1
+
+
+def test_invalidate():
+    cache = LabelCache(max_entries=10)
+    cache.put('ab', [], ['a', 'b'])
+    cache.put('b', [], ['b'])
+    cache.put('c', [], ['c'])
+    cache.invalidate(['a'])
+    assert cache.get('ab') is None
+    assert cache.get('b') == []
+    cache.invalidate(['b'])
+    assert cache.get('b') is None
+    assert len(cache) == 1
+
+
+def test_needs_a_limit():
+    with pytest.raises(ValueError):
+        LabelCache()
+
+
+def test_cached_get(label_store):
+    ab = Label('a', 'b', '', 1, epoch_ticks=1)
+    label_store.put(ab)
+    assert label_store.get('a', 'b', '') == ab
+    assert label_store.get('b', 'a', '') == ab
+    assert label_store.cache.hits == 1
+
+    ab2 = Label('a', 'b', '', -1, epoch_ticks=2)
+    label_store.put(ab2)
+    assert label_store.get('a', 'b', '') == ab2
+
+    with pytest.raises(KeyError):
+        label_store.get('a', 'c', '')
+    with pytest.raises(KeyError):
+        label_store.get('a', 'c', '')
+    label_store.put(Label('c', 'a', '', 1))
+    assert label_store.get('a', 'c', '').value == CorefValue.Positive
+
+
+def test_cached_get_many(label_store):
+    ab = Label('a', 'b', '', 1)
+    label_store.put(ab)
+    assert label_store.get_many([('a', 'b', ''), ('a', 'c', '')]) == \
+        {('a', 'b', ''): ab, ('a', 'c', ''): None}
+    hits = label_store.cache.hits
+    assert label_store.get('b', 'a', '') == ab
+    assert label_store.get_many([('c', 'a', '')]) == {('c', 'a', ''): None}
+    assert label_store.cache.hits == hits + 2
+
+
+def test_cached_directly_connected(label_store):
+    ab = Label('a', 'b', '', 1)
+    bc = Label('b', 'c', '', 1)
+    label_store.put(ab)
+    assert list(label_store.directly_connected('b')) == [ab]
+    assert list(label_store.directly_connected('b')) == [ab]
+    assert label_store.cache.hits == 1
+
+    # Writing a label for the other side of the dual key invalidates 'b'
+    label_store.put(bc)
+    assert list(label_store.directly_connected('b')) == [ab, bc]
+    assert frozenset(label_store.connected_component('a')) == \
+        frozenset([ab, bc])
+
+    label_store.delete_all()
+    assert list(label_store.directly_connected('b')) == []
@@ -0,0 +1,87 @@
+'''dossier.label.tests
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2012-2015 Diffeo, Inc.
+'''
+from __future__ import absolute_import, division, print_function
+
+from pyquchk import qc
+from pyquchk.arbitraries import int_, list_, tuple_
+import pytest
+
+from dossier.label import Label, LabelGraph, LabelStore, all_components
+from dossier.label.label import idents_from_label
+from dossier.label.tests import kvl  # noqa
+
+pytest.importorskip('numpy')
+
+
+@pytest.yield_fixture  # noqa
+def label_store(kvl):
+    lstore = LabelStore(kvl)
+    yield lstore
+    lstore.delete_all()
+
+
+def test_all_components(label_store):
+    label_store.put(Label('a', 'b', 'x', 1, epoch_ticks=1))
+    label_store.put(Label('c', 'b', 'x', 1, epoch_ticks=2))
+    label_store.put(Label('c', 'd', 'x', -1, epoch_ticks=3))
+    label_store.put(Label('e', 'f', 'x', 1, epoch_ticks=4))
+    label_store.put(Label('e', 'f', 'x', -1, epoch_ticks=5))
+    assert all_components(label_store) == {
+        ('a', None): ('a', None),
+        ('b', None): ('a', None),
+        ('c', None): ('a', None),
+        ('d', None): ('d', None),
+        ('e', None): ('e', None),
+        ('f', None): ('f', None),
+    }
+
+
+def test_all_components_subtopic(label_store):
+    label_store.put(Label('a', 'b', 'x', 1, '1', '2', epoch_ticks=1))
+    label_store.put(Label('b', 'c', 'x', 1, '3', '4', epoch_ticks=2))
+    label_store.put(Label('a', 'a', 'x', 1, '1', '5', epoch_ticks=3))
+    assert all_components(label_store) == {
+        ('a', None): ('a', None),
+        ('b', None): ('a', None),
+        ('c', None): ('a', None),
+    }
+    assert all_components(label_store, subtopic=True) == {
+        ('a', '1'): ('a', '1'),
+        ('a', '5'): ('a', '1'),
+        ('b', '2'): ('a', '1'),
+        ('b', '3'): ('b', '3'),
+        ('c', '4'): ('b', '3'),
+    }
+
+
+def test_all_components_empty(label_store):
+    assert all_components(label_store) == {}
+
+
+def test_all_components_matches_connected_component(label_store):
+    @qc
+    def _(labels=list_(length=int_(1, 20),
+                       elements=tuple_([int_(0, 7), int_(0, 7), int_(-1, 1),
+                                        int_(0, 1), int_(0, 1),
+                                        int_(0, 3)]))):
+        label_store.delete_all()
+        label_store.put_many(Label('c%d' % l[0], 'c%d' % l[1], 'x', l[2],
+                                   's%d' % l[3], 's%d' % l[4],
+                                   epoch_ticks=l[5])
+                             for l in labels)
+        graph = LabelGraph(label_store)
+        for subtopic in (False, True):
+            clusters = all_components(label_store, subtopic=subtopic)
+            assert all_components(graph, subtopic=subtopic) == clusters
+            for ident, root in clusters.iteritems():
+                component = set([ident])
+                for label in label_store.connected_component(
+                        ident if subtopic else ident[0]):
+                    component.update(idents_from_label(label, subtopic))
+                assert root == min(component)
+                assert component == \
+                    set(i for i, r in clusters.iteritems() if r == root)
+    _()
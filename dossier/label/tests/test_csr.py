@@ -0,0 +1,87 @@
+'''dossier.label.tests
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2012-2015 Diffeo, Inc.
+'''
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+from dossier.label import CorefValue, Label, LabelStore
+from dossier.label.csr import CsrLabelGraph, write_csr
+from dossier.label.tests import kvl  # noqa
+
+
+@pytest.yield_fixture  # noqa
+def label_store(kvl):
+    lstore = LabelStore(kvl)
+    yield lstore
+    lstore.delete_all()
+
+
+@pytest.fixture
+def labels():
+    return [Label('a', 'b', 'x', 1, epoch_ticks=1),
+            Label('a', 'b', 'y', 1, epoch_ticks=2),
+            Label('c', 'b', 'x', 1, epoch_ticks=3, rating=2),
+            Label('c', 'd', 'x', -1, epoch_ticks=4),
+            Label('e', 'f', 'x', 1, epoch_ticks=5),
+            Label('g', 'g', 'x', 1, '1', '2', epoch_ticks=6)]
+
+
+def test_write_read(tmpdir, labels):
+    path = str(tmpdir.join('positive.csr'))
+    assert write_csr(labels, path) == (6, 9)
+    with CsrLabelGraph(path) as graph:
+        assert graph.value == CorefValue.Positive
+        assert len(graph) == 6
+        assert list(graph) == ['a', 'b', 'c', 'e', 'f', 'g']
+        assert 'a' in graph
+        assert 'd' not in graph
+        assert graph.edges('b') == [('a', 1, 1), ('a', 1, 2), ('c', 2, 3)]
+        assert graph.neighbors('b') == ['a', 'c']
+        assert graph.neighbors('g') == ['g']
+        assert graph.neighbors('d') == []
+        assert graph.pair('b', 'a') == [(1, 1), (1, 2)]
+        assert graph.pair('a', 'c') == []
+        assert graph.pair('a', 'z') == []
+        assert graph.component('c') == ['a', 'b', 'c']
+        assert graph.component('z') == ['z']
+        assert graph.connected('a', 'c')
+        assert not graph.connected('a', 'e')
+        assert graph.connected('z', 'z')
+
+
+def test_negative(tmpdir, labels):
+    path = str(tmpdir.join('negative.csr'))
+    assert write_csr(labels, path, value=CorefValue.Negative) == (2, 2)
+    with CsrLabelGraph(path) as graph:
+        assert graph.value == CorefValue.Negative
+        assert graph.edges('d') == [('c', 0, 4)]
+
+
+def test_empty(tmpdir):
+    path = str(tmpdir.join('empty.csr'))
+    assert write_csr([], path) == (0, 0)
+    with CsrLabelGraph(path) as graph:
+        assert len(graph) == 0
+        assert graph.component('a') == ['a']
+
+
+def test_not_a_graph(tmpdir):
+    path = tmpdir.join('bad.csr')
+    path.write('x' * 100)
+    with pytest.raises(ValueError):
+        CsrLabelGraph(str(path))
+
+
+def test_matches_store(tmpdir, label_store, labels):
+    label_store.put_many(labels)
+    path = str(tmpdir.join('positive.csr'))
+    write_csr(label_store.everything(), path)
+    with CsrLabelGraph(path) as graph:
+        for cid in 'abcdefg':
+            component = set([cid])
+            for label in label_store.connected_component(cid):
+                component.update([label.content_id1, label.content_id2])
+            assert graph.component(cid) == sorted(component)
@@ -0,0 +1,121 @@
+'''dossier.label.tests
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2012-2015 Diffeo, Inc.
+'''
+from __future__ import absolute_import, division, print_function
+
+from pyquchk import qc
+from pyquchk.arbitraries import int_, list_, tuple_
+import pytest
+
+from dossier.label import Label, LabelGraph, LabelStore
+from dossier.label.tests import kvl  # noqa
+
+
+@pytest.yield_fixture  # noqa
+def label_store(kvl):
+    lstore = LabelStore(kvl, change_log=True)
+    yield lstore
+    lstore.delete_all()
+
+
+def test_graph_matches_store(label_store):
+    @qc
+    def _(labels=list_(length=int_(1, 12),
+                       elements=tuple_([int_(0, 4), int_(0, 4), int_(0, 1),
+                                        int_(-1, 1), int_(0, 1), int_(0, 1),
+                                        int_(0, 3)]))):
+        label_store.delete_all()
+        label_store.put_many(Label('c%d' % l[0], 'c%d' % l[1], 'a%d' % l[2],
+                                   l[3], 's%d' % l[4], 's%d' % l[5],
+                                   epoch_ticks=l[6])
+                             for l in labels)
+        graph = LabelGraph(label_store)
+        assert list(graph.everything()) == list(label_store.everything())
+        idents = ['c%d' % i for i in range(5)] + \
+            [('c%d' % i, 's%d' % j) for i in range(5) for j in range(2)]
+        for ident in idents:
+            for method in ('directly_connected', 'connected_component',
+                           'expand', 'expanded_pairs'):
+                assert list(getattr(graph, method)(ident)) == \
+                    list(getattr(label_store, method)(ident)), method
+        for cid in idents[:5]:
+            assert list(graph.negative_inference(cid)) == \
+                list(label_store.negative_inference(cid))
+            assert list(graph.everything(content_id=cid)) == \
+                list(label_store.everything(content_id=cid))
+        assert graph.are_coreferent('c0', 'c1') == \
+            label_store.are_coreferent('c0', 'c1')
+    _()
+
+
+def test_get(label_store):
+    ab = Label('a', 'b', 'x', 1, epoch_ticks=1)
+    label_store.put(ab)
+    graph = LabelGraph(label_store)
+    assert graph.get('b', 'a', 'x') == ab
+    with pytest.raises(KeyError):
+        graph.get('a', 'c', 'x')
+    with pytest.raises(ValueError):
+        graph.everything(include_deleted=True)
+
+
+def test_refresh(label_store):
+    label_store.put(Label('a', 'b', 'x', 1, epoch_ticks=10))
+    graph = LabelGraph(label_store)
+    assert graph.watermark == 10
+
+    bc = Label('b', 'c', 'x', 1, epoch_ticks=11)
+    ab = Label('a', 'b', 'x', -1, epoch_ticks=12)
+    label_store.put_many([bc, ab])
+    assert list(graph.connected_component('a')) == [graph.get('a', 'b', 'x')]
+    assert graph.refresh(batch_size=1) == 3
+    assert list(graph.connected_component('c')) == [bc]
+    assert graph.get('a', 'b', 'x') == ab
+    assert graph.refresh() == 0
+    assert graph.watermark == 12
+
+    # Written at the time of the last label read, with a smaller key
+    aa = Label('a', 'a', 'x', 1, 's1', 's2', epoch_ticks=12)
+    label_store.put(aa)
+    assert graph.refresh() == 1
+    assert graph.get('a', 'a', 'x', 's1', 's2') == aa
+    assert len(graph) == len(list(label_store.everything()))
+
+
+def test_refresh_same_time(label_store):
+    label_store.put(Label('b', 'c', 'x', 1, epoch_ticks=100))
+    graph = LabelGraph(label_store)
+    graph.refresh()
+    label_store.put(Label('a', 'b', 'x', 1, epoch_ticks=100))
+    assert graph.refresh() == 1
+    assert len(graph) == 2
+
+
+def test_add_copies(label_store):
+    content_id = ''.join(['a', 'b'])
+    ab = Label(content_id, 'c', 'x', 1, epoch_ticks=1)
+    graph = LabelGraph(label_store)
+    graph.add(ab)
+    assert ab.content_id1 is content_id
+    assert graph.get('ab', 'c', 'x') == ab
+    assert graph.get('ab', 'c', 'x').content_id1 is intern('ab')
+
+
+def test_add_unicode(label_store):
+    ab = Label(u'caf\xe9', 'b', u'x', 1, epoch_ticks=1)
+    graph = LabelGraph(label_store)
+    graph.add(ab)
+    assert graph.get(u'caf\xe9', 'b', u'x') == ab
+    assert list(graph.connected_component(u'caf\xe9')) == [ab]
+
+
+def test_refresh_without_change_log(kvl):
+    label_store = LabelStore(kvl)
+    graph = LabelGraph(label_store)
+    assert len(graph) == 0
+    label_store.put(Label('a', 'b', 'x', 1))
+    assert graph.refresh() == 1
+    assert len(graph) == 1
+    label_store.delete_all()
@@ -5,6 +5,9 @@
 '''
 from __future__ import absolute_import, division, print_function
 
+from collections import Container, Hashable
+import pickle
+
 from pyquchk import qc
 
 from dossier.label import Label
@@ -106,3 +109,29 @@ def test_label_order_on_value(cid1=id_, cid2=id_, ann=id_, t=time_value,
     assert ((v1 < v2 and lab1 < lab2) or
             (v1 == v2 and lab1 == lab2) or
             (v1 > v2 and lab1 > lab2))
+
+
+@qc
+def test_from_trusted(cid1=id_, cid2=id_, s1=id_, s2=id_, ann=id_,
+                      v=coref_value, t=time_value):
+    l = Label(cid1, cid2, ann, v, s1, s2, epoch_ticks=t)
+    trusted = Label._from_trusted(*[getattr(l, f) for f in l._fields])
+    assert trusted == l
+    assert hash(trusted) == hash(l)
+
+
+@qc
+def test_pickle(cid1=id_, cid2=id_, s1=id_, s2=id_, ann=id_,
+                v=coref_value, t=time_value):
+    l = Label(cid1, cid2, ann, v, s1, s2, epoch_ticks=t)
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        l2 = pickle.loads(pickle.dumps(l, protocol))
+        assert l2 == l
+        assert l2.value is l.value
+
+
+def test_slots():
+    l = Label('c1', 'c2', 'a', 1)
+    assert not hasattr(l, '__dict__')
+    assert isinstance(l, Container)
+    assert isinstance(l, Hashable)
@@ -5,16 +5,22 @@
 '''
 from __future__ import absolute_import, division, print_function
 
+import functools
+import json
+
 from pyquchk import qc
+from pyquchk.arbitraries import int_, list_, tuple_
 import pytest
 
+import kvlayer
+
 from dossier.label import Label, LabelStore
 from dossier.label.tests import kvl, coref_value, time_value, id_  # noqa
 
 
-@pytest.yield_fixture  # noqa
-def label_store(kvl):
-    lstore = LabelStore(kvl)
+@pytest.yield_fixture(params=['dual', 'single'])  # noqa
+def label_store(request, kvl):
+    lstore = LabelStore(kvl, layout=request.param)
     yield lstore
     lstore.delete_all()
 
@@ -75,6 +81,99 @@ def test_put_get_recent_unordered(label_store):
     _()
 
 
+def test_put_many(label_store):
+    ab = Label('a', 'b', '', 1, epoch_ticks=1)
+    ab2 = Label('b', 'a', '', -1, epoch_ticks=2)
+    ac = Label('a', 'c', 'x', 1, subtopic_id1='s1')
+    bc = Label('c', 'b', '', 0)
+    assert label_store.put_many(iter([ab, ab2, ac, bc]), batch_size=3) == 4
+
+    assert label_store.get('a', 'b', '') == ab2
+    assert label_store.get('b', 'a', '') == ab2
+    assert label_store.get('c', 'a', 'x', subid2='s1') == ac
+    assert list(label_store.everything()) == [ab2, ac, bc]
+    assert (list(label_store.everything(include_deleted=True)) ==
+            [ab2, ab, ac, bc])
+    assert list(label_store.directly_connected('b')) == [ab2, bc]
+
+
+def test_put_many_empty(label_store):
+    assert label_store.put_many([]) == 0
+    assert list(label_store.everything()) == []
+    with pytest.raises(ValueError):
+        label_store.put_many([Label('a', 'b', '', 1)], batch_size=0)
+
+
+def test_get_many(label_store):
+    ab = Label('a', 'b', 'x', 1, epoch_ticks=1)
+    ab2 = Label('a', 'b', 'x', -1, epoch_ticks=2)
+    ac = Label('a', 'c', 'x', 1, subtopic_id1='s1', subtopic_id2='s2')
+    bc = Label('b', 'c', 'y', 0)
+    label_store.put_many([ab, ab2, ac, bc])
+
+    keys = [('a', 'b', 'x'), ('b', 'a', 'x'), ('a', 'c', 'x', 's1', 's2'),
+            ('c', 'a', 'x', 's2', 's1'), ('a', 'c', 'x'), ('c', 'b', 'y'),
+            ('b', 'c', 'x')]
+    got = label_store.get_many(iter(keys), batch_size=2)
+    assert got == {
+        ('a', 'b', 'x'): ab2,
+        ('b', 'a', 'x'): ab2,
+        ('a', 'c', 'x', 's1', 's2'): ac,
+        ('c', 'a', 'x', 's2', 's1'): ac,
+        ('a', 'c', 'x'): None,
+        ('c', 'b', 'y'): bc,
+        ('b', 'c', 'x'): None,
+    }
+    missing = object()
+    assert label_store.get_many([('d', 'e', 'x')], default=missing) == \
+        {('d', 'e', 'x'): missing}
+
+
+def test_get_many_merges_pairs(label_store, monkeypatch):
+    ab = Label('a', 'b', 'x', 1, epoch_ticks=1)
+    ab_y = Label('a', 'b', 'y', -1, 's1', 's2', epoch_ticks=2)
+    ab_z = Label('a', 'b', 'z', 1, epoch_ticks=3)
+    aa = Label('a', 'a', 'x', 1, 's1', 's2', epoch_ticks=4)
+    aa2 = Label('a', 'a', 'x', -1, 's1', 's3', epoch_ticks=5)
+    cd = Label('c', 'd', 'x', 0, epoch_ticks=6)
+    label_store.put_many([ab, ab_y, ab_z, aa, aa2, cd])
+
+    ranges = []
+    scan = label_store.kvl.scan
+
+    def recording_scan(table_name, *key_ranges):
+        ranges.extend(key_ranges)
+        return scan(table_name, *key_ranges)
+    monkeypatch.setattr(label_store.kvl, 'scan', recording_scan)
+
+    got = label_store.get_many([('a', 'b', 'x'), ('b', 'a', 'y', 's2', 's1'),
+                                ('a', 'b', 'w'), ('a', 'a', 'x', 's2', 's1'),
+                                ('a', 'a', 'x', 's1', 's3'), ('c', 'd', 'x')])
+    assert got == {
+        ('a', 'b', 'x'): ab,
+        ('b', 'a', 'y', 's2', 's1'): ab_y,
+        ('a', 'b', 'w'): None,
+        ('a', 'a', 'x', 's2', 's1'): aa,
+        ('a', 'a', 'x', 's1', 's3'): aa2,
+        ('c', 'd', 'x'): cd,
+    }
+    assert ranges == [(('a', 'a'), ('a', 'a')), (('a', 'b'), ('a', 'b')),
+                      (('c', 'd', '', '', 'x'), ('c', 'd', '', '', 'x'))]
+
+
+def test_get_many_matches_get(label_store):
+    @qc
+    def _(cid1=id_, cid2=id_, ann=id_, v1=coref_value, v2=coref_value,
+          t=time_value):
+        label_store.delete_all()
+        label_store.put(Label(cid1, cid2, ann, v1, epoch_ticks=t))
+        label_store.put(Label(cid2, cid1, ann, v2, epoch_ticks=t + 1))
+        got = label_store.get_many([(cid1, cid2, ann), (cid2, cid1, ann)])
+        assert got[(cid1, cid2, ann)] == label_store.get(cid1, cid2, ann)
+        assert got[(cid2, cid1, ann)] == label_store.get(cid2, cid1, ann)
+    _()
+
+
 def test_everything_simple(label_store):
     @qc
     def _(cid1=id_, cid2=id_, ann=id_, v=coref_value):
@@ -116,6 +215,22 @@ def test_everything_overwrite(label_store):
     _()
 
 
+def test_everything_most_recent(label_store):
+    @qc
+    def _(labels=list_(length=int_(1, 8),
+                       elements=tuple_([int_(0, 3), int_(0, 3), int_(0, 1),
+                                        int_(0, 2), int_(0, 3)]))):
+        label_store.delete_all()
+        label_store.put_many(Label(*[str(part) for part in l[:3]],
+                                   subtopic_id1=str(l[3]),
+                                   value=1, epoch_ticks=l[4])
+                             for l in labels)
+        everything = list(label_store.everything(include_deleted=True))
+        assert list(label_store.everything()) == \
+            list(Label.most_recent(everything))
+    _()
+
+
 def test_everything_content_id(label_store):
     @qc
     def _(cid1a=id_, cid1b=id_, ann1=id_, v1=coref_value, t1=time_value,
@@ -320,6 +435,458 @@ def test_connected_component_many_most_recent_diff_value(label_store):
     assert frozenset(connected) == frozenset([ab])
 
 
+def test_connected_component_hash_collision(label_store):
+    # These two labels have the same hash.
+    aa = Label('c0', 'c0', 'x', 1, 's0', 's0', epoch_ticks=1)
+    ab = Label('c0', 'c2', 'x', 1, 's0', 's0', epoch_ticks=3)
+    assert hash(aa) == hash(ab)
+    label_store.put(aa)
+    label_store.put(ab)
+
+    connected = list(label_store.connected_component('c0'))
+    assert sorted(connected) == [aa, ab]
+
+
+def test_connected_component_scans_per_level(label_store, monkeypatch):
+    star = [Label('a', cid, '', 1) for cid in 'bcdefg']
+    tail = [Label('g', 'h', '', 1), Label('h', 'i', '', -1)]
+    label_store.put_many(star + tail)
+
+    scans = []
+    scan = label_store.kvl.scan
+
+    def counting_scan(table_name, *key_ranges):
+        scans.append(len(key_ranges))
+        return scan(table_name, *key_ranges)
+    monkeypatch.setattr(label_store.kvl, 'scan', counting_scan)
+
+    connected = list(label_store.connected_component('a'))
+    assert len(connected) == len(frozenset(connected))
+    assert frozenset(connected) == frozenset(star + tail[:1])
+    # a; then b..g; then h
+    if label_store.layout == 'dual':
+        assert scans == [1, 6, 1]
+    else:
+        # labels, then reverse index, then labels found through it
+        assert scans == [1, 1, 6, 6, 6, 1, 1, 1]
+
+
+def test_scan_clients(label_store, monkeypatch):
+    star = [Label('a', cid, '', 1) for cid in 'bcdefg']
+    tail = [Label('g', 'h', '', 1), Label('h', 'i', '', -1),
+            Label('c', 'b', 'x', 1, 's1', 's2')]
+    label_store.put_many(star + tail)
+    clients = [kvlayer.client(), kvlayer.client()]
+    concurrent = LabelStore(label_store.kvl, layout=label_store.layout,
+                            scan_clients=clients)
+
+    scans = []
+    for client in [label_store.kvl] + clients:
+        def recording_scan(table_name, *key_ranges, **kwargs):
+            scans.append((kwargs['client'], len(key_ranges)))
+            return kwargs['scan'](table_name, *key_ranges)
+        monkeypatch.setattr(client, 'scan', functools.partial(
+            recording_scan, client=client, scan=client.scan))
+
+    for ident in ['a', 'h', ('b', 's2'), 'z']:
+        assert list(concurrent.connected_component(ident)) == \
+            list(label_store.connected_component(ident))
+    del scans[:]
+    list(concurrent.connected_component('a'))
+    # b..g are split between the three clients
+    assert set(client for client, _ in scans) == \
+        set([label_store.kvl] + clients)
+    assert concurrent.get_many([('a', 'b', ''), ('b', 'c', 'x', 's2', 's1'),
+                                ('a', 'z', '')]) == \
+        label_store.get_many([('a', 'b', ''), ('b', 'c', 'x', 's2', 's1'),
+                              ('a', 'z', '')])
+
+
+def test_scan_clients_error(label_store, monkeypatch):
+    label_store.put_many([Label('a', cid, '', 1) for cid in 'bcd'])
+    client = kvlayer.client()
+    concurrent = LabelStore(label_store.kvl, layout=label_store.layout,
+                            scan_clients=[client])
+
+    def failing_scan(table_name, *key_ranges):
+        raise IOError('lost connection')
+    monkeypatch.setattr(client, 'scan', failing_scan)
+    with pytest.raises(IOError):
+        list(concurrent.connected_component('a'))
+
+
+@pytest.yield_fixture  # noqa
+def cluster_store(kvl):
+    lstore = LabelStore(kvl, cluster_index=True)
+    yield lstore
+    lstore.delete_all()
+
+
+def test_cluster_index(cluster_store):
+    cluster_store.put(Label('a', 'b', '', 1))
+    cluster_store.put(Label('c', 'd', '', 1))
+    cluster_store.put(Label('d', 'e', '', 1))
+    cluster_store.put(Label('e', 'f', '', -1))
+    cluster_store.put_many([Label('g', 'h', '', 0)])
+
+    assert cluster_store.members(cluster_store.cluster_of('a')) == ['a', 'b']
+    assert cluster_store.cluster_of('a') == cluster_store.cluster_of('b')
+    assert cluster_store.members(cluster_store.cluster_of('e')) == \
+        ['c', 'd', 'e']
+    assert cluster_store.cluster_of('f') == 'f'
+    assert cluster_store.members('f') == ['f']
+    assert cluster_store.members('g') == ['g']
+
+    cluster_store.put_many([Label('b', 'c', '', 1), Label('f', 'g', '', 1)])
+    root = cluster_store.cluster_of('a')
+    assert cluster_store.members(root) == ['a', 'b', 'c', 'd', 'e']
+    assert all(cluster_store.cluster_of(cid) == root for cid in 'abcde')
+    assert frozenset(cluster_store.members(cluster_store.cluster_of('g'))) \
+        == frozenset(['f', 'g'])
+
+
+def test_cluster_index_matches_components(cluster_store):
+    @qc
+    def _(edges=list_(length=int_(1, 12),
+                      elements=tuple_([int_(0, 8), int_(0, 8)]))):
+        cluster_store.delete_all()
+        edges = [(str(i), str(j)) for i, j in edges]
+        cluster_store.put_many(Label(cid1, cid2, '', 1)
+                               for cid1, cid2 in edges)
+        for cid1, cid2 in edges:
+            expected = set([cid1])
+            for label in cluster_store.connected_component(cid1):
+                expected.update([label.content_id1, label.content_id2])
+            members = cluster_store.members(cluster_store.cluster_of(cid1))
+            assert sorted(expected) == members
+    _()
+
+
+def test_cluster_index_one_write_per_batch(cluster_store, monkeypatch):
+    cluster_store.put_many([Label('a', 'b', '', 1), Label('c', 'd', '', 1)])
+    puts = []
+    put = cluster_store.kvl.put
+
+    def counting_put(table, *rows):
+        puts.append(table)
+        return put(table, *rows)
+    monkeypatch.setattr(cluster_store.kvl, 'put', counting_put)
+
+    cluster_store.put_many([Label('b', 'c', '', 1), Label('d', 'e', '', 1),
+                            Label('x', 'y', '', 1)])
+    assert puts.count(cluster_store.CLUSTER_TABLE) == 1
+    assert puts.count(cluster_store.CLUSTER_MEMBERS_TABLE) == 1
+    root = cluster_store.cluster_of('a')
+    assert cluster_store.members(root) == ['a', 'b', 'c', 'd', 'e']
+    assert cluster_store.members(cluster_store.cluster_of('x')) == ['x', 'y']
+
+
+def test_rebuild_cluster_index(cluster_store):
+    ab = Label('a', 'b', '', 1)
+    bc = Label('b', 'c', '', 1)
+    cluster_store.put_many([ab, bc])
+    assert cluster_store.members(cluster_store.cluster_of('c')) == \
+        ['a', 'b', 'c']
+
+    # Negating a label does not split the cluster until a rebuild
+    cluster_store.put(Label('b', 'c', '', -1, epoch_ticks=bc.epoch_ticks + 1))
+    assert cluster_store.cluster_of('c') == cluster_store.cluster_of('a')
+    assert cluster_store.rebuild_cluster_index() == 1
+    assert cluster_store.members(cluster_store.cluster_of('a')) == ['a', 'b']
+    assert cluster_store.cluster_of('c') == 'c'
+
+
+def test_cluster_index_disabled(label_store):
+    with pytest.raises(RuntimeError):
+        label_store.cluster_of('a')
+
+
+def test_are_coreferent(label_store):
+    label_store.put_many([Label('a', 'b', '', 1),
+                          Label('b', 'c', '', 1),
+                          Label('c', 'd', '', 1),
+                          Label('d', 'e', '', -1),
+                          Label('e', 'f', '', 1),
+                          Label('b', 'x', '', 1, epoch_ticks=1),
+                          Label('b', 'x', '', -1, epoch_ticks=2)])
+
+    assert label_store.are_coreferent('a', 'a')
+    assert label_store.are_coreferent('a', 'd')
+    assert label_store.are_coreferent('d', 'a')
+    assert label_store.are_coreferent('e', 'f')
+    assert not label_store.are_coreferent('a', 'e')
+    assert not label_store.are_coreferent('a', 'x')
+    assert not label_store.are_coreferent('a', 'nothing')
+    with pytest.raises(ValueError):
+        label_store.are_coreferent('a', ('b', '1'))
+
+
+def test_are_coreferent_matches_component(label_store):
+    @qc
+    def _(edges=list_(length=int_(1, 12),
+                      elements=tuple_([int_(0, 8), int_(0, 8),
+                                       int_(-1, 1)]))):
+        label_store.delete_all()
+        label_store.put_many(Label(str(i), str(j), '', v)
+                             for i, j, v in edges)
+        for i in range(9):
+            component = set([str(i)])
+            for label in label_store.connected_component(str(i)):
+                component.update([label.content_id1, label.content_id2])
+            for j in range(9):
+                assert label_store.are_coreferent(str(i), str(j)) == \
+                    (str(j) in component)
+    _()
+
+
+@pytest.yield_fixture  # noqa
+def annotator_store(kvl):
+    lstore = LabelStore(kvl, annotator_index=True)
+    yield lstore
+    lstore.delete_all()
+
+
+def test_by_annotator(annotator_store):
+    ab1 = Label('a', 'b', 'x', 1, epoch_ticks=10)
+    ab2 = Label('b', 'a', 'x', -1, epoch_ticks=30)
+    ac = Label('a', 'c', 'x', 1, epoch_ticks=20)
+    ad = Label('a', 'd', 'x', 1, epoch_ticks=40, subtopic_id1='s')
+    ay = Label('a', 'b', 'y', 1, epoch_ticks=25)
+    annotator_store.put_many([ab1, ab2, ac, ad, ay])
+
+    assert list(annotator_store.by_annotator('x')) == [ac, ab2, ad]
+    assert list(annotator_store.by_annotator('x', since=25)) == [ab2, ad]
+    assert list(annotator_store.by_annotator('x', since=41)) == []
+    assert list(annotator_store.by_annotator('y')) == [ay]
+    assert list(annotator_store.by_annotator('z')) == []
+
+
+def test_by_annotator_matches_everything(annotator_store):
+    @qc
+    def _(labels=list_(length=int_(1, 10),
+                       elements=tuple_([int_(0, 3), int_(0, 3), int_(0, 2),
+                                        int_(-1, 1), int_(0, 5)]))):
+        annotator_store.delete_all()
+        annotator_store.put_many(
+            Label(str(c1), str(c2), str(a), v, epoch_ticks=t)
+            for c1, c2, a, v, t in labels)
+        for ann in '012':
+            expected = [l for l in annotator_store.everything()
+                        if l.annotator_id == ann]
+            got = list(annotator_store.by_annotator(ann))
+            assert sorted(got) == expected
+            assert [l.epoch_ticks for l in got] == \
+                sorted(l.epoch_ticks for l in got)
+    _()
+
+
+def test_rebuild_annotator_index(label_store):
+    ab1 = Label('a', 'b', 'x', 1, epoch_ticks=10)
+    ab2 = Label('a', 'b', 'x', -1, epoch_ticks=30)
+    label_store.put_many([ab1, ab2])
+
+    annotator_store = LabelStore(label_store.kvl, annotator_index=True)
+    assert list(annotator_store.by_annotator('x')) == []
+    assert annotator_store.rebuild_annotator_index() == 2
+    assert list(annotator_store.by_annotator('x')) == [ab2]
+    with pytest.raises(RuntimeError):
+        label_store.by_annotator('x')
+
+
+@pytest.yield_fixture  # noqa
+def log_store(kvl):
+    lstore = LabelStore(kvl, change_log=True)
+    yield lstore
+    lstore.delete_all()
+
+
+def test_labels_since(log_store):
+    ab1 = Label('a', 'b', 'x', 1, epoch_ticks=10)
+    ab2 = Label('b', 'a', 'x', -1, epoch_ticks=30)
+    ac = Label('a', 'c', 'y', 1, epoch_ticks=20)
+    ad = Label('a', 'd', 'x', 1, epoch_ticks=30, subtopic_id1='s')
+    log_store.put_many([ab1, ab2, ac, ad])
+
+    labels, cursor = log_store.labels_since(0)
+    assert labels == [ab1, ac, ab2, ad]
+    assert log_store.labels_since(20)[0] == [ac, ab2, ad]
+    assert log_store.labels_since(0, cursor=cursor) == ([], cursor)
+
+    ae = Label('a', 'e', 'x', 1, epoch_ticks=25)
+    log_store.put(ae)
+    assert log_store.labels_since(0, cursor=cursor) == ([], cursor)
+    af = Label('a', 'f', 'x', 1, epoch_ticks=40)
+    log_store.put(af)
+    assert log_store.labels_since(0, cursor=cursor)[0] == [af]
+
+
+def test_labels_since_same_time(log_store):
+    bc = Label('b', 'c', 'x', 1, epoch_ticks=100)
+    log_store.put(bc)
+    labels, cursor = log_store.labels_since(0)
+    assert labels == [bc]
+
+    # Written after the cursor was taken, at the same time but with a
+    # smaller key
+    ab = Label('a', 'b', 'x', 1, epoch_ticks=100)
+    log_store.put(ab)
+    labels, cursor = log_store.labels_since(
+        0, cursor=json.loads(json.dumps(cursor)))
+    assert labels == [ab]
+    assert log_store.labels_since(0, cursor=cursor) == ([], cursor)
+
+    cd = Label('c', 'd', 'x', 1, epoch_ticks=100)
+    log_store.put(cd)
+    assert log_store.labels_since(0, cursor=cursor)[0] == [cd]
+
+
+def test_labels_since_paged(log_store):
+    labels = [Label('a', str(i % 3), 'x', 1, epoch_ticks=i // 2)
+              for i in range(11)]
+    log_store.put_many(labels)
+    expected, _ = log_store.labels_since(0)
+    assert len(expected) == 11
+
+    got = []
+    cursor = None
+    while True:
+        page, cursor = log_store.labels_since(0, cursor=cursor, limit=3)
+        # The cursor is one log key, however many labels share a time
+        assert len(cursor) <= 7
+        # The cursor survives a round trip through JSON
+        cursor = json.loads(json.dumps(cursor))
+        if not page:
+            break
+        assert len(page) <= 3
+        got.extend(page)
+    assert got == expected
+    assert log_store.labels_since(0, limit=0) == ([], (0,))
+
+
+def test_rebuild_change_log(label_store):
+    ab1 = Label('a', 'b', 'x', 1, epoch_ticks=10)
+    ab2 = Label('a', 'b', 'x', -1, epoch_ticks=30)
+    label_store.put_many([ab1, ab2])
+
+    log_store = LabelStore(label_store.kvl, change_log=True)
+    assert log_store.labels_since(0)[0] == []
+    assert log_store.rebuild_change_log() == 2
+    assert log_store.labels_since(0)[0] == [ab1, ab2]
+    with pytest.raises(RuntimeError):
+        label_store.labels_since(0)
+
+
+def test_compact(label_store):
+    revisions = [Label('a', 'b', 'x', v, epoch_ticks=t)
+                 for t, v in enumerate([1, -1, 1, 0, 1])]
+    other = [Label('c', 'b', 'x', 1, epoch_ticks=t) for t in range(3)]
+    single = Label('a', 'a', 'x', 1, '1', '2')
+    label_store.put_many(revisions + other + [single])
+    before = list(label_store.everything())
+
+    stats = label_store.compact(keep_history=2, dry_run=True)
+    assert stats['labels'] == 4
+    assert stats['rows'] == (8 if label_store.layout == 'dual' else 4)
+    assert stats['bytes'] > 0
+    assert len(list(label_store.everything(include_deleted=True))) == 9
+
+    assert label_store.compact(keep_history=2, older_than=2) == \
+        dict(stats, labels=3, rows=stats['rows'] * 3 // 4,
+             bytes=stats['bytes'] * 3 // 4)
+    assert list(label_store.everything(include_deleted=True)) == \
+        [single, revisions[4], revisions[3], revisions[2], other[2],
+         other[1]]
+
+    assert label_store.compact(batch_size=1)['labels'] == 3
+    assert list(label_store.everything(include_deleted=True)) == before
+    assert list(label_store.everything()) == before
+    assert list(label_store.directly_connected('b')) == \
+        [revisions[4], other[2]]
+    assert label_store.compact()['labels'] == 0
+    with pytest.raises(ValueError):
+        label_store.compact(keep_history=0)
+
+
+def test_compact_indexes(kvl):
+    lstore = LabelStore(kvl, subtopic_index=True, annotator_index=True,
+                        change_log=True)
+    old = Label('a', 'b', 'x', 1, '1', '2', epoch_ticks=1)
+    new = Label('a', 'b', 'x', -1, '1', '2', epoch_ticks=2)
+    lstore.put_many([old, new])
+
+    stats = lstore.compact(dry_run=True)
+    assert stats['labels'] == 1
+    assert stats['rows'] == 5
+    assert lstore.compact() == stats
+    for table in [lstore.TABLE, lstore.SUBTOPIC_TABLE,
+                  lstore.ANNOTATOR_TABLE]:
+        assert len(list(kvl.scan(table))) == \
+            (2 if table != lstore.ANNOTATOR_TABLE else 1)
+    assert list(lstore.directly_connected(('b', '2'))) == [new]
+    assert list(lstore.by_annotator('x')) == [new]
+    assert lstore.labels_since(0)[0] == [old, new]
+    lstore.delete_all()
+
+
+def test_migrate_layout(kvl):
+    dual = LabelStore(kvl)
+    labels = [Label('a', 'b', 'x', 1, epoch_ticks=1),
+              Label('a', 'b', 'x', -1, epoch_ticks=2),
+              Label('a', 'b', 'y', 1),
+              Label('c', 'b', 'x', 1, '1', '2'),
+              Label('a', 'a', 'x', 1, '1', '2')]
+    dual.put_many(labels)
+
+    def contents(lstore):
+        return (list(lstore.everything(include_deleted=True)),
+                dict((cid, list(lstore.directly_connected(cid)))
+                     for cid in 'abc'),
+                list(lstore.directly_connected(('b', '2'))),
+                list(lstore.connected_component('c')))
+    before = contents(dual)
+
+    single = LabelStore(kvl, layout='single')
+    # Labels written before and during the migration are all visible
+    ca = Label('c', 'a', 'x', -1)
+    single.put(ca)
+    dual_ca = Label('c', 'a', 'x', -1, epoch_ticks=ca.epoch_ticks - 1)
+    dual.put(dual_ca)
+    after = (before[0] + [dual_ca], before[1], before[2], before[3])
+    after[0].insert(0, ca)
+    after[0].sort()
+    after[1]['a'] = after[1]['a'] + [ca]
+    after[1]['c'] = [ca] + after[1]['c']
+    assert contents(single) == after
+
+    assert single.migrate_layout(batch_size=2) == {'reverse': 3, 'rows': 6}
+    assert len(list(kvl.scan(single.TABLE))) == 7
+    assert contents(single) == after
+    assert single.migrate_layout() == {'reverse': 3, 'rows': 0}
+    with pytest.raises(RuntimeError):
+        dual.migrate_layout()
+    single.delete_all()
+    assert list(kvl.scan(single.REVERSE_TABLE)) == []
+
+
+def test_bad_layout(kvl):
+    with pytest.raises(ValueError):
+        LabelStore(kvl, layout='triple')
+
+
+def test_intern_ids(kvl):
+    lstore = LabelStore(kvl, intern_ids=True)
+    lstore.put_many(Label(''.join(['c', '1']), 'c' + str(i), 'ann', 1)
+                    for i in range(2, 5))
+    labels = list(lstore.everything())
+    assert len(labels) == 3
+    assert labels[0].content_id1 is labels[1].content_id1 is \
+        labels[2].content_id1
+    component = list(lstore.connected_component(''.join(['c', '2'])))
+    assert component[0].content_id1 is labels[0].content_id1
+    assert lstore.are_coreferent('c2', 'c4')
+    lstore.delete_all()
+
+
 def test_expand(label_store):
     ab = Label('a', 'b', '', 1)
     bc = Label('b', 'c', '', 1)
@@ -345,6 +912,82 @@ def test_expand(label_store):
     assert label_store.expand('f') == [Label('f', 'g', '', 1)]
 
 
+def test_iter_expand(label_store):
+    ab = Label('a', 'b', 'x', 1)
+    ab2 = Label('a', 'b', 'y', 1)
+    bc = Label('b', 'c', '', 1)
+    cd = Label('c', 'd', '', 1)
+    ae = Label('a', 'e', '', -1)
+    label_store.put_many([ab, ab2, bc, cd, ae])
+
+    expanded = label_store.expand('a')
+    assert len(expanded) == 7
+    assert sorted(label_store.iter_expand('a')) == sorted(expanded)
+    assert label_store.expand_count('a') == 7
+    assert list(label_store.expanded_pairs('c')) == [
+        ('a', 'b'), ('a', 'c'), ('a', 'd'), ('b', 'c'), ('b', 'd'),
+        ('c', 'd')]
+
+    assert label_store.expand_count('e') == 0
+    assert list(label_store.iter_expand('e')) == []
+    assert list(label_store.expanded_pairs('e')) == []
+
+
+def test_expand_count_matches_expand(label_store):
+    @qc
+    def _(edges=list_(length=int_(1, 12),
+                      elements=tuple_([int_(0, 6), int_(0, 6), int_(0, 2),
+                                       int_(0, 1)]))):
+        label_store.delete_all()
+        label_store.put_many(Label(str(i), str(j), str(a), 1,
+                                   subtopic_id1=str(s), subtopic_id2='0')
+                             for i, j, a, s in edges)
+        for ident in ['0', ('0', '0'), ('0', '1')]:
+            expanded = label_store.expand(ident)
+            assert label_store.expand_count(ident) == len(expanded)
+            pairs = list(label_store.expanded_pairs(ident))
+            assert len(pairs) == len(set(pairs))
+            if isinstance(ident, tuple):
+                pairs = set(pairs)
+                for label in expanded:
+                    ident1, ident2 = sorted(
+                        [(label.content_id1, label.subtopic_id1),
+                         (label.content_id2, label.subtopic_id2)])
+                    assert ident1 == ident2 or (ident1, ident2) in pairs
+    _()
+
+
+def test_clique(label_store):
+    ab = Label('a', 'b', '', 1)
+    bc = Label('b', 'c', '', 1)
+    cd = Label('c', 'd', '', 1)
+    ae = Label('a', 'e', '', -1)
+    label_store.put_many([ab, bc, cd, ae])
+
+    clique = label_store.clique('b')
+    assert sorted(clique.labels) == sorted([ab, bc, cd])
+    assert list(clique) == ['a', 'b', 'c', 'd']
+    assert len(clique) == 4
+    assert 'a' in clique and ('d', None) in clique and ('d', 'x') in clique
+    assert 'e' not in clique
+    assert clique.coreferent('a', 'd')
+    assert not clique.coreferent('a', 'e')
+    assert clique.pair_count() == 6
+    assert list(clique.pairs()) == list(label_store.expanded_pairs('a'))
+    assert frozenset(clique.expanded_labels()) == \
+        frozenset(label_store.expand('a'))
+    assert clique.expanded_count() == 6
+    assert frozenset(clique.inferred_labels()) == frozenset([
+        Label('a', 'c', '', 1), Label('a', 'd', '', 1),
+        Label('b', 'd', '', 1)])
+
+    lonely = label_store.clique('e')
+    assert list(lonely) == ['e']
+    assert lonely.pair_count() == 0
+    assert lonely.expanded_count() == 0
+    assert list(lonely.expanded_labels()) == []
+
+
 def test_negative_label_inference(label_store):
     ac = Label('a', 'c', '', 1)
     bc = Label('b', 'c', '', 1)
@@ -416,6 +1059,88 @@ def test_negative_inference(label_store):
         frozenset(correct_pairs)
 
 
+def test_negative_inference_chain(label_store):
+    # c's component is a chain, so not every member shares a label
+    # with c
+    label_store.put_many([Label('a', 'b', '', 1),
+                          Label('b', 'c', '', 1),
+                          Label('c', 'd', '', -1)])
+
+    def get_pair(label):
+        return (label.content_id1, label.content_id2)
+
+    assert frozenset(map(get_pair, label_store.negative_inference('d'))) == \
+        frozenset([('a', 'd'), ('b', 'd'), ('c', 'd')])
+
+
+def test_negative_inference_memoized(label_store, monkeypatch):
+    label_store.put_many([Label('a', 'b', '', 1),
+                          Label('b', 'c', '', 1),
+                          Label('x', 'a', '', -1),
+                          Label('x', 'b', '', -1),
+                          Label('x', 'c', '', -1)])
+    components = {}
+    list(label_store.negative_inference('x', components))
+    assert components['a'] is components['b'] is components['c']
+    assert list(components['x']) == ['x']
+
+    scans = []
+    scan = label_store.kvl.scan
+
+    def counting_scan(table_name, *key_ranges):
+        scans.append(key_ranges)
+        return scan(table_name, *key_ranges)
+    monkeypatch.setattr(label_store.kvl, 'scan', counting_scan)
+    list(label_store.negative_inference('x', components))
+    assert len(scans) == (1 if label_store.layout == 'dual' else 3)
+
+
+def test_negative_inference_many(label_store):
+    label_store.put_many([Label('a', 'c', '', 1),
+                          Label('b', 'c', '', 1),
+                          Label('d', 'e', '', 1),
+                          Label('d', 'f', '', 1),
+                          Label('c', 'g', '', -1),
+                          Label('d', 'g', '', -1),
+                          Label('h', 'g', '', 1)])
+
+    content_ids = ['g', 'c', 'd', 'h', 'z']
+    got = list(label_store.negative_inference_many(iter(content_ids),
+                                                   batch_size=2))
+    assert [content_id for content_id, _ in got] == content_ids
+    for content_id, labels in got:
+        expected = label_store.negative_inference(content_id)
+        assert (sorted((l.content_id1, l.content_id2) for l in labels) ==
+                sorted((l.content_id1, l.content_id2) for l in expected))
+    assert got[-1] == ('z', [])
+
+
+def test_find_conflicts(label_store):
+    ab = Label('a', 'b', 'x', 1, epoch_ticks=1)
+    bc = Label('b', 'c', 'x', 1, epoch_ticks=2)
+    ac = Label('a', 'c', 'y', -1, epoch_ticks=3)
+    cd = Label('c', 'd', 'y', -1, epoch_ticks=4)
+    ef = Label('e', 'f', 'x', 1, epoch_ticks=5)
+    fe = Label('f', 'e', 'y', -1, epoch_ticks=6)
+    label_store.put_many([ab, bc, ac, cd, ef, fe])
+
+    assert sorted(label_store.find_conflicts()) == [ac, fe]
+
+    # A newer positive label replaces the conflicting negative one.
+    label_store.put(Label('a', 'c', 'y', 1, epoch_ticks=7))
+    assert list(label_store.find_conflicts()) == [fe]
+
+
+def test_find_conflicts_subtopic(label_store):
+    ab = Label('a', 'b', 'x', 1, '1', '2')
+    ab2 = Label('a', 'b', 'x', -1, '3', '2')
+    aa = Label('a', 'a', 'x', -1, '1', '3')
+    label_store.put_many([ab, ab2, aa])
+
+    assert sorted(label_store.find_conflicts()) == [ab2]
+    assert list(label_store.find_conflicts(subtopic=True)) == []
+
+
 # Subtopic testing is below.
 
 
@@ -460,3 +1185,117 @@ def test_sub_expand(label_store):
 
     connected = list(label_store.expand(('a', '1')))
     assert frozenset(connected) == frozenset([a1b2, b2c3, a1c3])
+
+
+def test_sub_clique(label_store):
+    a1b2 = Label('a', 'b', '', 1, '1', '2')
+    b2c3 = Label('b', 'c', '', 1, '2', '3')
+    b4c5 = Label('b', 'c', '', 1, '4', '5')
+    label_store.put_many([a1b2, b2c3, b4c5])
+
+    clique = label_store.clique(('a', '1'))
+    assert list(clique) == [('a', '1'), ('b', '2'), ('c', '3')]
+    assert ('c', '3') in clique
+    assert ('c', '5') not in clique
+    assert 'c' not in clique
+    assert list(clique.inferred_labels()) == [Label('a', 'c', '', 1, '1', '3')]
+
+
+def test_sub_are_coreferent(label_store):
+    label_store.put_many([Label('a', 'b', '', 1, '1', '2'),
+                          Label('b', 'c', '', 1, '2', '3'),
+                          Label('b', 'c', '', 1, '4', '5')])
+    assert label_store.are_coreferent(('a', '1'), ('c', '3'))
+    assert not label_store.are_coreferent(('a', '1'), ('c', '5'))
+    assert label_store.are_coreferent('a', 'c')
+
+
+@pytest.yield_fixture  # noqa
+def subtopic_store(kvl):
+    lstore = LabelStore(kvl, subtopic_index=True)
+    yield lstore
+    lstore.delete_all()
+
+
+def test_sub_index_direct_connect(subtopic_store, monkeypatch):
+    a1b2 = Label('a', 'b', '', 1, '1', '2')
+    a1c3 = Label('a', 'c', '', 1, '1', '3')
+    b2c3 = Label('b', 'c', '', 1, '2', '3')
+    a4b2 = Label('a', 'b', '', 1, '4', '2')
+    a1a4 = Label('a', 'a', '', 1, '1', '4')
+    subtopic_store.put_many([a1b2, a1c3, b2c3, a4b2, a1a4])
+
+    rows = []
+    scan = subtopic_store.kvl.scan
+
+    def counting_scan(table_name, *key_ranges):
+        for row in scan(table_name, *key_ranges):
+            rows.append(row)
+            yield row
+    monkeypatch.setattr(subtopic_store.kvl, 'scan', counting_scan)
+
+    assert list(subtopic_store.directly_connected(('a', '1'))) == \
+        [a1a4, a1b2, a1c3]
+    assert len(rows) == 3
+    assert list(subtopic_store.directly_connected(('a', '4'))) == \
+        [a1a4, a4b2]
+    assert list(subtopic_store.everything(content_id='b',
+                                          subtopic_id='2')) == \
+        [a1b2, a4b2, b2c3]
+    assert frozenset(subtopic_store.connected_component(('c', '3'))) == \
+        frozenset([a1b2, a1c3, b2c3, a4b2, a1a4])
+
+
+def test_sub_index_matches_scan(subtopic_store):
+    plain_store = LabelStore(subtopic_store.kvl)
+
+    @qc
+    def _(labels=list_(length=int_(1, 10),
+                       elements=tuple_([int_(0, 3), int_(0, 3), int_(0, 2),
+                                        int_(0, 2), int_(-1, 1),
+                                        int_(0, 2)]))):
+        subtopic_store.delete_all()
+        subtopic_store.put_many(
+            Label(str(c1), str(c2), '', v, subtopic_id1=str(s1),
+                  subtopic_id2=str(s2), epoch_ticks=t)
+            for c1, c2, s1, s2, v, t in labels)
+        for cid in '0123':
+            for sid in '012':
+                assert (frozenset(subtopic_store.everything(
+                    content_id=cid, subtopic_id=sid)) ==
+                    frozenset(plain_store.everything(
+                        content_id=cid, subtopic_id=sid)))
+                assert (frozenset(subtopic_store.directly_connected(
+                    (cid, sid))) ==
+                    frozenset(plain_store.directly_connected((cid, sid))))
+    _()
+
+
+def test_rebuild_subtopic_index(label_store):
+    a1b2 = Label('a', 'b', '', 1, '1', '2')
+    a1a4 = Label('a', 'a', '', 1, '1', '4')
+    label_store.put_many([a1b2, a1a4])
+
+    subtopic_store = LabelStore(label_store.kvl, subtopic_index=True)
+    assert list(subtopic_store.directly_connected(('a', '1'))) == []
+    assert subtopic_store.rebuild_subtopic_index() == 4
+    assert list(subtopic_store.directly_connected(('a', '1'))) == \
+        [a1a4, a1b2]
+    with pytest.raises(RuntimeError):
+        label_store.rebuild_subtopic_index()
+
+
+def test_delete_all_clears_every_index(label_store):
+    full_store = LabelStore(label_store.kvl, cluster_index=True,
+                            subtopic_index=True, annotator_index=True,
+                            change_log=True, layout='single')
+    full_store.put_many([Label('a', 'b', 'x', 1, '1', '2'),
+                         Label('b', 'c', 'x', -1)])
+    label_store.delete_all()
+
+    assert list(full_store.everything()) == []
+    assert full_store.cluster_of('a') == 'a'
+    assert list(full_store.directly_connected(('a', '1'))) == []
+    assert list(full_store.directly_connected('c')) == []
+    assert list(full_store.by_annotator('x')) == []
+    assert full_store.labels_since(0)[0] == []
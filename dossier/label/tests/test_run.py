@@ -5,14 +5,18 @@
 
 '''
 from __future__ import absolute_import
+import argparse
 from cStringIO import StringIO
+import json
 
 import pytest
+import yakonfig
 
 from kvlayer._local_memory import LocalStorage
 
 from dossier.label import CorefValue, Label, LabelStore
-from dossier.label.run import App
+from dossier.label.run import App, LabelStoreConfig, label_store_options, \
+    label_to_dict
 
 
 @pytest.fixture
@@ -32,6 +36,7 @@ def app(label_store):
     a = App()
     a._label_store = label_store
     a.stdout = StringIO()
+    a.stderr = StringIO()
     return a
 
 
@@ -103,3 +108,155 @@ def test_list_subtopics(app, label_store):
 
     assert (app.stdout.getvalue() ==
             'c1(s1) ==(1) c2(s2) by a1 at 2009-02-13 23:31:30\n')
+
+
+def test_rebuild_clusters(app, label_store):
+    label_store.put(Label('c1', 'c2', 'a1', CorefValue.Positive))
+    label_store.put(Label('c3', 'c4', 'a1', CorefValue.Positive))
+
+    app.runcmd('rebuild_clusters', [])
+
+    assert app.stdout.getvalue() == '2 clusters\n'
+    clusters = LabelStore(label_store.kvl, cluster_index=True)
+    assert clusters.members(clusters.cluster_of('c2')) == ['c1', 'c2']
+
+
+def test_compact(app, label_store):
+    for t in range(3):
+        label_store.put(Label('c1', 'c2', 'a1', CorefValue.Positive,
+                              epoch_ticks=1234567890 + t))
+
+    app.runcmd('compact', ['--dry-run'])
+    app.runcmd('compact', ['--keep-history', '2'])
+    app.runcmd('list', ['--include-deleted'])
+
+    assert (app.stdout.getvalue() ==
+            'would delete 2 labels (4 rows, 60 bytes)\n'
+            'deleted 1 labels (2 rows, 30 bytes)\n'
+            'c1 ==(1) c2 by a1 at 2009-02-13 23:31:32\n'
+            'c1 ==(1) c2 by a1 at 2009-02-13 23:31:31\n')
+
+
+@pytest.mark.parametrize('n', ['0', '-1'])
+def test_compact_keep_history_not_positive(app, label_store, n):
+    with pytest.raises(SystemExit):
+        app.runcmd('compact', ['--keep-history', n])
+    assert app.stdout.getvalue() == ''
+
+
+def test_migrate_layout(app, label_store):
+    label_store.put(Label('c1', 'c2', 'a1', CorefValue.Positive))
+    label_store.put(Label('c3', 'c2', 'a1', CorefValue.Positive))
+
+    app.runcmd('migrate_layout', [])
+
+    assert app.stdout.getvalue() == \
+        '2 reverse index rows written, 2 label rows deleted\n'
+    single = LabelStore(label_store.kvl, layout='single')
+    assert len(list(single.directly_connected('c2'))) == 2
+
+
+def test_conflicts(app, label_store):
+    label_store.put(Label('c1', 'c2', 'a1', CorefValue.Positive,
+                          epoch_ticks=1))
+    label_store.put(Label('c2', 'c1', 'a2', CorefValue.Negative,
+                          epoch_ticks=2))
+
+    app.runcmd('conflicts', [])
+
+    assert [json.loads(line) for line in app.stdout.getvalue().splitlines()] \
+        == [{'content_id1': 'c1', 'content_id2': 'c2', 'annotator_id': 'a2',
+             'value': -1, 'subtopic_id1': '', 'subtopic_id2': '',
+             'epoch_ticks': 2, 'rating': 0}]
+
+
+@pytest.mark.parametrize('fmt', ['json', 'jsonl'])
+def test_dump_load(app, label_store, tmpdir, fmt):
+    labels = [Label('c1', 'c2', 'a1', CorefValue.Positive,
+                    epoch_ticks=1234567890),
+              Label('c1', 'c2', 'a1', CorefValue.Negative,
+                    epoch_ticks=1234567891),
+              Label('c2', 'c3', 'a2', CorefValue.Unknown,
+                    subtopic_id1='s1', subtopic_id2='s2',
+                    epoch_ticks=1234567890)]
+    label_store.put_many(labels)
+
+    app.runcmd('dump_all', ['--format', fmt])
+    dumped = app.stdout.getvalue()
+    if fmt == 'jsonl':
+        assert len(dumped.splitlines()) == 3
+        assert json.loads(dumped.splitlines()[0])['value'] == -1
+        assert app.stderr.getvalue().startswith('dumped 3 labels')
+    else:
+        assert len(json.loads(dumped)) == 3
+
+    label_store.delete_all()
+    path = tmpdir.join('labels')
+    path.write(dumped)
+    app.runcmd('load', [str(path), '--format', fmt, '--batch-size', '2'])
+    assert list(label_store.everything(include_deleted=True)) == \
+        sorted(labels)
+    assert app.stderr.getvalue().splitlines()[-1].startswith(
+        'loaded 3 labels')
+
+
+def test_load_workers(app, label_store, tmpdir):
+    app.new_label_store = lambda: LabelStore(label_store.kvl)
+    labels = [Label('c%d' % i, 'c%d' % (i + 1), 'a1', CorefValue.Positive,
+                    epoch_ticks=1234567890) for i in range(10)]
+    lines = [json.dumps(label_to_dict(label)) for label in labels]
+    lines[3:3] = ['{"content_id1": ', '{"content_id1": "c1"}']
+    path = tmpdir.join('labels')
+    path.write('\n'.join(lines) + '\n')
+
+    app.runcmd('load', [str(path), '--format', 'jsonl', '--batch-size', '2',
+                        '--workers', '3'])
+    assert list(label_store.everything()) == sorted(labels)
+    errors = app.stderr.getvalue().splitlines()
+    assert len([line for line in errors if line.startswith('failed')]) == 2
+    assert errors[-1].startswith('loaded 10 labels')
+    assert errors[-1].endswith(', 2 failed')
+
+
+def test_load_bad_label(app, label_store, tmpdir):
+    labels = [Label('c%d' % i, 'c%d' % (i + 1), 'a1', CorefValue.Positive,
+                    epoch_ticks=1234567890) for i in range(5)]
+    rows = [label_to_dict(label) for label in labels]
+    rows.insert(2, dict(rows[0], content_id1='bad', rating=300))
+    path = tmpdir.join('labels')
+    path.write(json.dumps(rows))
+
+    app.runcmd('load', [str(path)])
+    assert list(label_store.everything()) == sorted(labels)
+    errors = app.stderr.getvalue().splitlines()
+    failed = [line for line in errors if line.startswith('failed')]
+    assert len(failed) == 1
+    assert failed[0].startswith('failed label bad ==')
+    assert errors[-1].startswith('loaded 5 labels')
+    assert errors[-1].endswith(', 1 failed')
+
+
+@pytest.mark.parametrize('option', ['--workers', '--batch-size'])
+@pytest.mark.parametrize('n', ['0', '-1'])
+def test_load_not_positive(app, label_store, tmpdir, option, n):
+    path = tmpdir.join('labels')
+    path.write('[]')
+    with pytest.raises(SystemExit):
+        app.runcmd('load', [str(path), option, n])
+
+
+def test_label_store_options():
+    assert label_store_options()['layout'] == 'dual'
+    p = argparse.ArgumentParser()
+    try:
+        yakonfig.parse_args(p, [yakonfig, LabelStoreConfig()],
+                            args=['--subtopic-index', '--layout', 'single'])
+        assert label_store_options() == {
+            'cluster_index': False,
+            'subtopic_index': True,
+            'annotator_index': False,
+            'change_log': False,
+            'layout': 'single',
+        }
+    finally:
+        yakonfig.clear_global_config()
@@ -44,6 +44,9 @@ setup(
         'pytest',
         'yakonfig >= 0.7.2',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
     include_package_data=True,
     zip_safe=False,
     entry_points={